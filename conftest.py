@@ -14,5 +14,6 @@ def access_token():
     UserProfile.objects.create(username="auth", password=make_password('123456'), is_superuser=True)
     url = reverse('login-list')
     client = APIClient()
-    client.post(url, data={'username': 'auth', 'password': '123456', 'grant_type': 'password',
-                           'client_id': client_id, 'client_secret': client_secret})
+    response = client.post(url, data={'username': 'auth', 'password': '123456', 'grant_type': 'password',
+                                      'client_id': client_id, 'client_secret': client_secret})
+    return response.data['access_token']
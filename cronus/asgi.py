@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cronus.settings')
 
 application = get_asgi_application()
+
+# the progress streams of runs are served here, every other request goes to django
+from services.stream import ProgressStream  # noqa: E402
+
+application = ProgressStream(application)
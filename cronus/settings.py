@@ -13,7 +13,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 from pathlib import Path
 import os
 
-from kombu import Queue
+from kombu import Queue, Exchange
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
@@ -144,6 +144,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = '/media/'
 
+# 不公开的文件, nginx只提供MEDIA_ROOT下的文件, 这里的文件只能通过需要认证的接口读取
+PRIVATE_ROOT = os.getenv('PRIVATE_ROOT', os.path.join(BASE_DIR, "private"))
+
+# 请求结果超过RESPONSE_INLINE_LIMIT字节时, 压缩存储到PRIVATE_ROOT下的文件中, 数据库只保存引用和预览
+RESPONSE_INLINE_LIMIT = int(os.getenv('RESPONSE_INLINE_LIMIT', 64 * 1024))
+RESPONSE_PREVIEW_SIZE = int(os.getenv('RESPONSE_PREVIEW_SIZE', 1024))
+RESPONSE_STORE_DIR = 'responses'
+# 录制的请求和响应保存在PRIVATE_ROOT下的目录, 回放时不访问网络, 录制内容包含cookie和认证头部, 不能公开
+CASSETTE_DIR = 'cassettes'
+# 每个worker进程缓存的回放录制数量
+CASSETTE_CACHE_SIZE = int(os.getenv('CASSETTE_CACHE_SIZE', 64))
+
 
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',
@@ -191,6 +203,60 @@ LOCALHOST = os.getenv('LOCALHOST', 'http://localhost:8081')
 FRONT_URL = os.getenv('FRONT_URL', 'http://localhost:8080')
 
 
+# HTTP连接池配置, 同一次测试集运行中的用例共享连接和cookie
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+
+# 每个worker进程缓存的已编译用例数量, 用例更新(updateTime变化)后自动重新编译
+CASE_PLAN_CACHE_SIZE = int(os.getenv('CASE_PLAN_CACHE_SIZE', 512))
+# 每个worker进程缓存解析后的配置, 配置变更时通过redis版本号通知所有进程, redis不可用时缓存CONFIG_CACHE_TTL秒
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', 60))
+
+# 测试集运行时用例结果先缓存在内存中, 每隔RESULT_BUFFER_FLUSH_INTERVAL秒或缓存RESULT_BUFFER_SIZE条后批量写入数据库
+RESULT_BUFFER_FLUSH_INTERVAL = float(os.getenv('RESULT_BUFFER_FLUSH_INTERVAL', 5))
+RESULT_BUFFER_SIZE = int(os.getenv('RESULT_BUFFER_SIZE', 100))
+# 未写入数据库的用例执行状态保存在redis中的过期时间(秒)
+RESULT_LIVE_TTL = int(os.getenv('RESULT_LIVE_TTL', 24 * 60 * 60))
+
+# 可共享的前置用例在同一批次中只执行一次, 提取的变量在redis中保存SHARED_SETUP_TTL秒,
+# 其他测试集最多等待SHARED_SETUP_WAIT秒
+SHARED_SETUP_TTL = int(os.getenv('SHARED_SETUP_TTL', 30 * 60))
+SHARED_SETUP_WAIT = int(os.getenv('SHARED_SETUP_WAIT', 5 * 60))
+
+# 任务中的测试集按历史平均时长从长到短派发, SET_WORKERS为执行测试集的worker进程数, 用于预测任务总时长,
+# SET_DURATION_ALPHA为计算平均时长时最近一次执行的权重
+SET_WORKERS = int(os.getenv('SET_WORKERS', 2))
+SET_DURATION_ALPHA = float(os.getenv('SET_DURATION_ALPHA', 0.3))
+
+# 测试集很多的任务每次只派发TASK_CHUNK_SIZE个测试集, 一批执行完成后再派发下一批
+# 下一批要等上一批最慢的测试集完成, 批次越小空闲的worker越多
+TASK_CHUNK_SIZE = int(os.getenv('TASK_CHUNK_SIZE', 200))
+
+# 同一个用例、测试集或任务同时只能运行一次, 运行锁的过期时间为预计运行时长的RUN_LOCK_TTL_FACTOR倍,
+# 不少于RUN_LOCK_MIN_TTL秒, 没有历史时长时为RUN_LOCK_TTL秒
+RUN_LOCK_TTL = int(os.getenv('RUN_LOCK_TTL', 2 * 60 * 60))
+RUN_LOCK_MIN_TTL = int(os.getenv('RUN_LOCK_MIN_TTL', 10 * 60))
+RUN_LOCK_TTL_FACTOR = float(os.getenv('RUN_LOCK_TTL_FACTOR', 3))
+
+# 运行中的worker每隔HEARTBEAT_INTERVAL秒发送一次心跳, 超过REAPER_GRACE秒没有心跳的运行被标记为Aborted并释放运行锁,
+# 每隔REAPER_INTERVAL秒检查一次, REAPER_REQUEUE为true时被中止的运行重新排队
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', 30))
+REAPER_GRACE = int(os.getenv('REAPER_GRACE', 30 * 60))
+REAPER_INTERVAL = int(os.getenv('REAPER_INTERVAL', 5 * 60))
+REAPER_REQUEUE = os.getenv('REAPER_REQUEUE', 'false').lower() == 'true'
+
+# 运行进度通过redis发布, cronus/asgi.py在PROGRESS_PATH下以server-sent events推送给前端,
+# 没有进度时每隔PROGRESS_KEEPALIVE秒发送一次保活注释
+PROGRESS_PATH = os.getenv('PROGRESS_PATH', '/v1/services/progress/')
+PROGRESS_KEEPALIVE = float(os.getenv('PROGRESS_KEEPALIVE', 15))
+# 压测运行中每隔LOAD_PROGRESS_INTERVAL秒发布一次请求数和失败数
+LOAD_PROGRESS_INTERVAL = float(os.getenv('LOAD_PROGRESS_INTERVAL', 5))
+
+# 历史记录清理, 按项目配置的保留条数和天数每隔HISTORY_PRUNE_INTERVAL秒清理一次, 每次删除HISTORY_PRUNE_BATCH条
+HISTORY_PRUNE_INTERVAL = int(os.getenv('HISTORY_PRUNE_INTERVAL', 10 * 60))
+HISTORY_PRUNE_BATCH = int(os.getenv('HISTORY_PRUNE_BATCH', 500))
+
+
 # 日志配置
 LOGGING = {
     'version': 1,
@@ -246,16 +312,30 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Shanghai'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_RESULT_EXTENDED = True
-CELERY_TASK_QUEUE = (
-    Queue('celery', exchange='celery', routing_key='task.#'),
-    # Queue('task', exchange='task', routing_key='runtask.#')
+# 执行队列按类别分为api.*和ui.*, ui队列由安装了浏览器的低并发worker消费, api队列由高并发worker消费;
+# 手动执行进入*.interactive队列, 定时任务进入*.scheduled队列, 其他后台任务进入celery队列,
+# worker按-Q参数的顺序和消息优先级取任务, 数字越小优先级越高
+INTERACTIVE_QUEUE = 'interactive'
+SCHEDULED_QUEUE = 'scheduled'
+INTERACTIVE_PRIORITY = int(os.getenv('INTERACTIVE_PRIORITY', 0))
+SCHEDULED_PRIORITY = int(os.getenv('SCHEDULED_PRIORITY', 6))
+CELERY_TASK_QUEUES = (Queue('celery', exchange=Exchange('celery', type='topic'), routing_key='task.#'),) + tuple(
+    Queue('{}.{}'.format(category, kind), exchange=Exchange('{}.{}'.format(category, kind), type='topic'),
+          routing_key='{}.{}.#'.format(category, kind))
+    for category in ('api', 'ui') for kind in (INTERACTIVE_QUEUE, SCHEDULED_QUEUE)
 )
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'queue_order_strategy': 'priority'
+}
+# 每个worker进程只预取一个任务, 避免空闲的worker拿不到手动执行的任务
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
 CELERY_DEFAULT_EXCHANGE_TYPE = 'topic'
 CELERY_DEFAULT_ROUTING_KEY = 'task.celery'
 CELERY_TASK_ROUTES = {
     'services.tasks.run_case': {
-        'queue': 'celery',
-        'routing_key': 'task.runcase'
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
     },
     'services.tasks.bound_set_to_task': {
         'queue': 'celery',
@@ -266,22 +346,57 @@ CELERY_TASK_ROUTES = {
         'routing_key': 'task.runcase'
     },
     'services.tasks.run_task': {
-        'queue': 'celery',
-        'routing_key': 'task.runcase'
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
     },
     'services.tasks.run_set': {
-        'queue': 'celery',
-        'routing_key': 'task.runcase'
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
     },
     'services.tasks.periodic_task': {
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
+    },
+    'services.tasks.save_task_result': {
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
+    },
+    'services.tasks.run_load': {
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
+    },
+    'services.tasks.save_task_chunk': {
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
+    },
+    'services.tasks.save_set_result': {
+        'queue': 'api.scheduled',
+        'routing_key': 'api.scheduled.run'
+    },
+    'services.tasks.prune_histories': {
         'queue': 'celery',
         'routing_key': 'task.runcase'
     },
-    'services.tasks.save_task_result': {
+    'services.tasks.reap_runs': {
         'queue': 'celery',
         'routing_key': 'task.runcase'
     }
 }
+CELERY_BEAT_SCHEDULE = {
+    'prune-histories': {
+        'task': 'services.tasks.prune_histories',
+        'schedule': HISTORY_PRUNE_INTERVAL
+    },
+    'reap-runs': {
+        'task': 'services.tasks.reap_runs',
+        'schedule': REAPER_INTERVAL
+    }
+}
 
-CELERYD_MAX_TASKS_PER_CHILD = 10
+# 每次运行的变量、会话和浏览器在运行结束后释放, worker进程可以长时间复用
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.getenv('CELERY_WORKER_MAX_TASKS_PER_CHILD', 1000))
 DJANGO_CELERY_BEAT_TZ_AWARE = False
+
+
+# redis配置, 默认与celery broker使用同一个redis
+REDIS_URL = os.getenv('REDIS_URL', CELERY_BROKER_URL)
@@ -14,7 +14,7 @@ echo "add new user"
 adduser -D cronus
 
 if [[ ! $args ]];then
-    echo "the args value should be 'task' or 'celery'"
+    echo "the args value should be 'task', 'celery', 'api', 'interactive' or 'ui'"
 elif [[ $args == "task" ]];then
     echo "**********start task worker**********"
     su -m cronus -c "celery -A cronus worker -Q task -l info -c $concurrency"
@@ -22,8 +22,21 @@ elif [[ $args == "beat" ]]; then
     echo "**********start beat**********"
     su -m cronus -c "celery -A cronus beat -l info -S django --pidfile=/tmp/celerybeat.pid"
 elif [[ $args == "celery" ]];then
+    # one pool for every queue, interactive runs waiting in the queue are taken first
     echo "**********start celery worker**********"
-    su -m cronus -c "celery -A cronus worker -Q celery -l info -c $concurrency --max-tasks-per-child 50"
+    su -m cronus -c "celery -A cronus worker -Q api.interactive,ui.interactive,api.scheduled,ui.scheduled,celery -l info -c $concurrency -O fair"
+elif [[ $args == "api" ]];then
+    # api runs are light and wait on the network, selenium is never imported
+    echo "**********start api worker**********"
+    su -m cronus -c "celery -A cronus worker -Q api.interactive,api.scheduled,celery -l info -c ${args2:-8} -O fair"
+elif [[ $args == "interactive" ]];then
+    # capacity kept for api runs started by users, periodic tasks never take these processes
+    echo "**********start interactive worker**********"
+    su -m cronus -c "celery -A cronus worker -Q api.interactive -l info -c $concurrency -O fair"
+elif [[ $args == "ui" ]];then
+    # every ui run holds a browser, keep the pool small
+    echo "**********start ui worker**********"
+    su -m cronus -c "celery -A cronus worker -Q ui.interactive,ui.scheduled -l info -c ${args2:-1} -O fair"
 else
-    echo "start worker failed, the args value should be 'task' or 'celery'"
+    echo "start worker failed, the args value should be 'task', 'celery', 'api', 'interactive' or 'ui'"
 fi
\ No newline at end of file
@@ -14,8 +14,11 @@ sudo mkdir -p /run/nginx/
 sudo nginx
 
 echo "**********start celery worker**********"
-# su -m cronus -c "celery -A cronus worker -Q celery -l info -c $concurrency --max-tasks-per-child 50 > logs/celery.log 2>&1 &"
-celery -A cronus worker -Q celery -l info -c $concurrency --max-tasks-per-child 50 > logs/celery.log 2>&1 &
+# su -m cronus -c "celery -A cronus worker -Q api.interactive,ui.interactive,api.scheduled,ui.scheduled,celery -l info -c $concurrency -O fair > logs/celery.log 2>&1 &"
+celery -A cronus worker -Q api.interactive,ui.interactive,api.scheduled,ui.scheduled,celery -l info -c $concurrency -O fair > logs/celery.log 2>&1 &
+
+echo '**********start progress streams**********'
+uvicorn cronus.asgi:application --host 127.0.0.1 --port 8001 > logs/asgi.log 2>&1 &
 
 echo '**********start django web application**********'
 # su -m cronus -c 'uwsgi --ini backend_uwsgi.ini'
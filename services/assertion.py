@@ -1,8 +1,25 @@
 from services.extract import Extractor
+from services.response import Body
 from services.comparison import Comparison
 
 
 class Asserts:
+    handlers = {
+        'code': 'assert_status_code',
+        'text': 'assert_response_text',
+        'response_header': 'assert_response_header'
+    }
+
+    @classmethod
+    def dispatch(cls, select):
+        """
+        :param select: part of the response to assert, must be code、text or response_header
+        :return: method asserting that part of object of request response
+        """
+        if select not in cls.handlers:
+            raise ValueError("The value of 'select' should be 'code'、'text' or 'response_header'")
+        return getattr(cls, cls.handlers[select])
+
     @classmethod
     def asserts(cls, contents, **kwargs):
         """
@@ -10,15 +27,23 @@ class Asserts:
         :param kwargs:
         :return:
         """
-        select = kwargs.get('select', None)
-        if select == 'code':
-            cls.assert_code(str(contents.status_code), **kwargs)
-        elif select == 'text':
-            cls.assert_text(contents.text, **kwargs)
-        elif select == 'response_header':
-            cls.assert_text(contents.headers, **kwargs)
+        cls.dispatch(kwargs.get('select', None))(contents, **kwargs)
+
+    @classmethod
+    def assert_status_code(cls, contents, **kwargs):
+        cls.assert_code(str(contents.status_code), **kwargs)
+
+    @classmethod
+    def assert_response_text(cls, contents, **kwargs):
+        cls.assert_text(contents.body, **kwargs)
+
+    @classmethod
+    def assert_response_header(cls, contents, **kwargs):
+        if kwargs.get('comparator') == 'contains':
+            # header names are matched case-insensitively
+            cls.assert_text(contents.response.headers, **kwargs)
         else:
-            raise ValueError("The value of 'select' should be 'code'、'text' or 'response_header'")
+            cls.assert_text(contents.header_body, **kwargs)
 
     @classmethod
     def assert_code(cls, contents, **kwargs):
@@ -28,7 +53,8 @@ class Asserts:
     def assert_text(cls, contents, **kwargs):
         comparator = kwargs.get('comparator')
         if comparator == 'contains':
-            Comparison.execute(comparison=comparator, source=contents, target=kwargs.get('expected_value'))
+            source = contents.text if isinstance(contents, Body) else contents
+            Comparison.execute(comparison=comparator, source=source, target=kwargs.get('expected_value'))
         elif comparator == 'equal':
             contents = Extractor.extractor(contents, **kwargs)
             Comparison.execute(comparison=comparator, source=contents, target=kwargs.get('expected_value'))
@@ -0,0 +1,161 @@
+import json
+import time
+import logging
+import threading
+from redis import RedisError
+from django.db import transaction
+from django.utils import timezone
+from cronus.settings import RESULT_BUFFER_FLUSH_INTERVAL, RESULT_BUFFER_SIZE, RESULT_LIVE_TTL
+from services.models import Histories
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+RESULT_FIELDS = ['status', 'result', 'error_message', 'end_time', 'response', 'image', 'timing']
+
+
+def live_key(batch):
+    return 'cronus:live:{}'.format(batch)
+
+
+def live_status(batch):
+    """
+    :param batch: batch of the run, type(string)
+    :return: histories of the batch which are not written to the database yet, keyed by relation id, type(dict)
+    """
+    client = get_redis()
+    if client is None:
+        return {}
+    try:
+        records = client.hgetall(live_key(batch))
+    except RedisError as e:
+        logger.warning("read live status of batch {} failed: {}".format(batch, e))
+        return {}
+    return {key: json.loads(value) for key, value in records.items()}
+
+
+class ResultBuffer(object):
+    """
+    Write-behind buffer of the case results of a set run. Finished results are written with one bulk_create
+    every RESULT_BUFFER_FLUSH_INTERVAL seconds or RESULT_BUFFER_SIZE results and when the set is done,
+    running cases are only published to redis. Without redis running cases are written at the next flush.
+    """
+
+    def __init__(self, batch, interval=RESULT_BUFFER_FLUSH_INTERVAL, size=RESULT_BUFFER_SIZE):
+        """
+        :param batch: batch of the run, type(string)
+        :param interval: seconds between two flushes, type(float)
+        :param size: flush once this many results are pending, type(int)
+        """
+        self.batch = batch
+        self.interval = interval
+        self.size = size
+        self.pending = {}
+        self.saved = set()
+        self.live = True
+        self.flushes = 0
+        self.flushed_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def _publish(self, history):
+        client = get_redis() if self.live else None
+        if client is None:
+            self.live = False
+            return
+        record = {
+            'id': str(history.id),
+            'status': history.status,
+            'start_time': history.start_time.isoformat(),
+            'batch': str(self.batch),
+            'set_cases': str(history.set_cases_id)
+        }
+        try:
+            pipe = client.pipeline()
+            pipe.hset(live_key(self.batch), str(history.set_cases_id), json.dumps(record))
+            pipe.expire(live_key(self.batch), RESULT_LIVE_TTL)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("publish live status failed, running cases are written to database: {}".format(e))
+            self.live = False
+
+    def _unpublish(self, relation_ids):
+        if not self.live or not relation_ids:
+            return
+        try:
+            get_redis().hdel(live_key(self.batch), *[str(relation_id) for relation_id in relation_ids])
+        except RedisError as e:
+            logger.warning("remove live status failed: {}".format(e))
+
+    def _maybe_flush(self):
+        if len(self.pending) >= self.size or time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def start(self, relation, start_time):
+        """
+        :param relation: instance of CasesRelationShip, type(object)
+        :param start_time: type(datetime)
+        :return: unsaved instance of Histories
+        """
+        history = Histories(set_cases=relation, start_time=start_time, status='Starting', batch=self.batch)
+        with self.lock:
+            self.pending[history.id] = history
+        self._publish(history)
+        self._maybe_flush()
+        return history
+
+    def finish(self, history, **fields):
+        """
+        :param history: instance of Histories returned by start
+        :param fields: values of RESULT_FIELDS
+        """
+        for name, value in fields.items():
+            setattr(history, name, value)
+        with self.lock:
+            self.pending[history.id] = history
+        self._maybe_flush()
+
+    def record(self, relations, **fields):
+        """
+        Finished results of cases which are not run, written at the next flush
+        :param relations: instances of CasesRelationShip, type(list)
+        :param fields: values of RESULT_FIELDS
+        """
+        now = timezone.now()
+        with self.lock:
+            for relation in relations:
+                history = Histories(set_cases=relation, start_time=now, end_time=now, status='Done',
+                                    batch=self.batch, **fields)
+                self.pending[history.id] = history
+
+    def skip(self, relations, reason=None):
+        """
+        Mark cases which are not run as Skipped
+        :param relations: instances of CasesRelationShip, type(list)
+        :param reason: why the cases are skipped, type(string)
+        """
+        self.record(relations, result='Skipped', error_message=reason)
+
+    def flush(self):
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            histories = [history for history in self.pending.values()
+                         if history.status != 'Starting' or (not self.live and history.id not in self.saved)]
+            if not histories:
+                return
+            created = [history for history in histories if history.id not in self.saved]
+            updated = [history for history in histories if history.id in self.saved]
+            with transaction.atomic():
+                Histories.objects.bulk_create(created)
+                Histories.objects.bulk_update(updated, RESULT_FIELDS)
+            self.flushes += 1
+
+            finished = []
+            for history in histories:
+                self.saved.add(history.id)
+                if history.status != 'Starting':
+                    finished.append(history.set_cases_id)
+                    del self.pending[history.id]
+            self._unpublish(finished)
+        logger.info("batch: {}, flush {} created, {} updated case results".format(self.batch, len(created),
+                                                                                 len(updated)))
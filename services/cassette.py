@@ -0,0 +1,145 @@
+import os
+import json
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+from cronus.settings import PRIVATE_ROOT, CASSETTE_DIR, CASSETTE_CACHE_SIZE
+from services.timing import TimedAdapter
+
+
+logger = logging.getLogger()
+
+# case whose requests are recorded or replayed by the current thread
+current = threading.local()
+# headers describing the raw body, the stored body is already decoded
+SKIP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+# per process LRU cache of the cassettes replayed, keyed by path
+cassettes = OrderedDict()
+lock = threading.RLock()
+
+
+def use(case_id):
+    current.case = str(case_id)
+
+
+def _path(case_id):
+    return os.path.join(PRIVATE_ROOT, CASSETTE_DIR, '{}.json'.format(case_id))
+
+
+def _signature(request, with_body=True):
+    name = '{} {}'.format(request.method, request.url)
+    if not with_body:
+        return name
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return '{} {}'.format(name, hashlib.sha256(body).hexdigest())
+
+
+def load(case_id):
+    """
+    :param case_id: id of the case, type(string)
+    :return: recorded interactions of the case keyed by request signature, type(dict)
+    """
+    path = _path(case_id)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    with lock:
+        cached = cassettes.get(path)
+        if cached and cached[0] == mtime:
+            cassettes.move_to_end(path)
+            return cached[1]
+        with open(path, encoding='utf-8') as f:
+            interactions = json.load(f).get('interactions', {})
+        cassettes[path] = (mtime, interactions)
+        cassettes.move_to_end(path)
+        while len(cassettes) > CASSETTE_CACHE_SIZE:
+            cassettes.popitem(last=False)
+    return interactions
+
+
+def record(case_id, request, response):
+    """
+    Save the response of a request of the case, a later response of the same request replaces it
+    """
+    content = response.content or b''
+    try:
+        body = {'text': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        body = {'base64': base64.b64encode(content).decode('ascii')}
+    interaction = {
+        'request': {'method': request.method, 'url': request.url},
+        'response': dict(body, status_code=response.status_code, reason=response.reason, url=response.url,
+                         encoding=response.encoding,
+                         headers={key: value for key, value in response.headers.items()
+                                  if key.lower() not in SKIP_HEADERS})
+    }
+    path = _path(case_id)
+    with lock:
+        interactions = dict(load(case_id))
+        interactions[_signature(request)] = interaction
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'case': case_id, 'interactions': interactions}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        cassettes.pop(path, None)
+
+
+class RecordAdapter(TimedAdapter):
+    """
+    Sends requests to the network and saves every response into the cassette of the current case
+    """
+
+    def send(self, request, **kwargs):
+        response = super(RecordAdapter, self).send(request, **kwargs)
+        case_id = getattr(current, 'case', None)
+        if case_id:
+            record(case_id, request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Local stub serving the responses recorded for the current case, the network is never touched
+    """
+
+    def send(self, request, **kwargs):
+        case_id = getattr(current, 'case', None)
+        interactions = load(case_id) if case_id else {}
+        interaction = interactions.get(_signature(request))
+        if interaction is None:
+            # the body may contain values generated per run, fall back to method and url
+            name = _signature(request, with_body=False)
+            interaction = next((item for key, item in interactions.items() if key.rsplit(' ', 1)[0] == name), None)
+        if interaction is None:
+            raise ConnectionError('no recorded response of case {} for {} {}'.format(case_id, request.method,
+                                                                                    request.url), request=request)
+
+        stored = interaction['response']
+        response = Response()
+        response.status_code = stored['status_code']
+        response.reason = stored.get('reason')
+        response.headers = CaseInsensitiveDict(stored.get('headers') or {})
+        response.encoding = stored.get('encoding')
+        response.url = stored.get('url') or request.url
+        response.request = request
+        response.connection = self
+        if 'base64' in stored:
+            response._content = base64.b64decode(stored['base64'])
+        else:
+            response._content = stored.get('text', '').encode('utf-8')
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
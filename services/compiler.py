@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import OrderedDict
+from cronus.settings import CASE_PLAN_CACHE_SIZE
+from services.substitute import Parser
+from services.assertion import Asserts
+from services.extract import Extractor
+
+
+logger = logging.getLogger()
+
+
+class CompiledAssertion(object):
+    def __init__(self, kwargs):
+        """
+        :param kwargs: assertion of the case, type(dict)
+        """
+        self.kwargs = Extractor.compile(kwargs)
+        try:
+            self.handler = Asserts.dispatch(kwargs.get('select', None))
+        except ValueError as e:
+            self.handler = None
+            self.error = e
+
+    def check(self, contents):
+        """
+        :param contents: object of request response
+        """
+        if self.handler is None:
+            raise self.error
+        self.handler(contents, **self.kwargs)
+
+
+class CasePlan(object):
+    def __init__(self, instance):
+        """
+        Everything of a case that does not depend on variables, compiled once
+        :param instance: instance of test case, type(object)
+        """
+        self.key = (instance.id, instance.updateTime)
+        self.body = Parser.compile(instance.body)
+        self.procedures = Parser.compile(instance.procedures)
+        self.asserts = [CompiledAssertion(kwargs) for kwargs in instance.asserts or []]
+        self.extracts = [Extractor.compile(kwargs) for kwargs in instance.extracts or []]
+        self.urls = {}
+
+    def url(self, url):
+        """
+        :param url: url of the case joined with the base url of the config, type(string)
+        :return: object of CompiledTemplate
+        """
+        template = self.urls.get(url)
+        if template is None:
+            template = self.urls[url] = Parser.compile(url)
+        return template
+
+
+class PlanCache(object):
+    """
+    Per process LRU cache of case plans, a plan is rebuilt when the updateTime of its case changes
+    """
+    plans = OrderedDict()
+    lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, instance):
+        """
+        :param instance: instance of test case, type(object)
+        :return: object of CasePlan
+        """
+        key = (instance.id, instance.updateTime)
+        with cls.lock:
+            plan = cls.plans.get(instance.id)
+            if plan is not None and plan.key == key:
+                cls.plans.move_to_end(instance.id)
+                cls.hits += 1
+                return plan
+            cls.misses += 1
+
+        plan = CasePlan(instance)
+        with cls.lock:
+            cls.plans[instance.id] = plan
+            cls.plans.move_to_end(instance.id)
+            while len(cls.plans) > CASE_PLAN_CACHE_SIZE:
+                cls.plans.popitem(last=False)
+        return plan
+
+    @classmethod
+    def invalidate(cls, case_id):
+        with cls.lock:
+            cls.plans.pop(case_id, None)
+
+    @classmethod
+    def stats(cls):
+        return {'size': len(cls.plans), 'hits': cls.hits, 'misses': cls.misses}
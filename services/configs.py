@@ -0,0 +1,102 @@
+import time
+import logging
+import threading
+from redis import RedisError
+from cronus.settings import CONFIG_CACHE_TTL
+from services.models import Config
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+VERSION_KEY = 'cronus:config:version'
+
+
+class ResolvedConfig(object):
+    """
+    Global config of a project merged with the config of a set, shared by every run and never changed
+    """
+
+    def __init__(self, configs):
+        """
+        :param configs: configs to merge, lowest priority first, type(list)
+        """
+        self.headers = {}
+        self.variables = {}
+        self.base_url = None
+        self.proxy = []
+        for config in configs:
+            self.headers.update(config.headers or {})
+            self.variables.update(config.variables or {})
+            self.base_url = config.baseurl or self.base_url
+            self.proxy = config.proxy or self.proxy
+
+
+def resolve(project_id, category, set_id=None):
+    """
+    :param project_id: id of the project, type(string)
+    :param category: must be ui、api, type(string)
+    :param set_id: id of the test set, its config is merged over the global config, type(string)
+    :return: object of ResolvedConfig
+    """
+    configs = Config.objects.filter(globalConfig=1, project_id=project_id, category=category)[:1]
+    configs = list(configs)
+    if set_id:
+        config = Config.objects.filter(sets=set_id).first()
+        if config and config not in configs:
+            configs.append(config)
+    return ResolvedConfig(configs)
+
+
+class ConfigCache(object):
+    """
+    Per process cache of resolved configs keyed by project, category and set. Saving a config bumps a version
+    stamp in redis so every worker drops its entries, without redis entries expire after CONFIG_CACHE_TTL.
+    """
+    configs = {}
+    lock = threading.Lock()
+    version = None
+    # redis is not asked again for a while after it failed
+    unavailable_until = 0
+
+    @classmethod
+    def _remote_version(cls):
+        client = get_redis()
+        if client is None or time.monotonic() < cls.unavailable_until:
+            return None
+        try:
+            return client.get(VERSION_KEY) or '0'
+        except RedisError as e:
+            logger.warning("read config version failed: {}".format(e))
+            cls.unavailable_until = time.monotonic() + CONFIG_CACHE_TTL
+            return None
+
+    @classmethod
+    def get(cls, project_id, category, set_id=None):
+        key = (str(project_id), category, set_id and str(set_id))
+        version = cls._remote_version()
+        now = time.monotonic()
+        with cls.lock:
+            if version is not None and version != cls.version:
+                cls.configs.clear()
+                cls.version = version
+            cached = cls.configs.get(key)
+            if cached and (version is not None or now - cached[0] < CONFIG_CACHE_TTL):
+                return cached[1]
+
+        config = resolve(project_id, category, set_id)
+        with cls.lock:
+            cls.configs[key] = (now, config)
+        return config
+
+    @classmethod
+    def invalidate(cls):
+        with cls.lock:
+            cls.configs.clear()
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.incr(VERSION_KEY)
+        except RedisError as e:
+            logger.warning("bump config version failed: {}".format(e))
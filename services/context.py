@@ -0,0 +1,71 @@
+import logging
+from collections import ChainMap
+from services.session import SessionPool
+
+
+logger = logging.getLogger()
+
+
+class CaseScope(ChainMap):
+    """
+    Variables seen by a case: its own variables shadow the run, values it writes (extracted variables) go to the
+    run so the following cases see them
+    """
+
+    def __setitem__(self, key, value):
+        self.maps[1][key] = value
+
+    def __delitem__(self, key):
+        del self.maps[1][key]
+
+
+class RunContext(object):
+    """
+    State of one run of a case, a set or a virtual user of a load run. The resolved config is layered, never
+    copied or changed, so nothing outlives the run once it is released.
+    """
+
+    def __init__(self, key, config=None, counter=None, cassette=None):
+        """
+        :param key: id of the run, type(string)
+        :param config: global config merged with the config of the set, type(ResolvedConfig)
+        :param counter: counter of the task, type(dict)
+        :param cassette: must be None、record or replay, type(string)
+        """
+        self.key = key
+        self.run_variables = {}
+        self.variables = ChainMap(self.run_variables, dict(counter or {}), config.variables if config else {})
+        self.headers = ChainMap({}, config.headers if config else {})
+        self.base_url = config.base_url if config else None
+        self.proxy = config.proxy if config else []
+        self.driver = None
+        self.cassette = cassette
+        self.sessions = SessionPool(cassette)
+        self.released = False
+
+    def scope(self, variables=None, headers=None):
+        """
+        :param variables: variables of the case, type(dict)
+        :param headers: headers of the case, type(dict)
+        :return: variables and headers seen by the case, type(tuple)
+        """
+        return (CaseScope(dict(variables or {}), *self.variables.maps),
+                ChainMap(dict(headers or {}), *self.headers.maps))
+
+    def quit_driver(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.error("quit web driver failed: {}".format(e))
+            self.driver = None
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.quit_driver()
+        sessions = self.sessions.close()
+        logger.info("release run: {}, variables: {}, http sessions: {}".format(self.key, self.run_variables,
+                                                                              sessions))
+        self.run_variables.clear()
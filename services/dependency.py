@@ -0,0 +1,138 @@
+import json
+import queue
+import string
+import logging
+import threading
+from django.db import connection
+
+
+logger = logging.getLogger()
+
+
+def references(target):
+    """
+    Names of the variables referenced by target, in the same syntax substituted by Parser
+    :param target: string, list or dict
+    :return: set of variable names
+    """
+    if not target:
+        return set()
+    if not isinstance(target, str):
+        target = json.dumps(target)
+    names = set()
+    for match in string.Template.pattern.finditer(target):
+        name = match.group('named') or match.group('braced')
+        if name:
+            names.add(name)
+    return names
+
+
+class Node(object):
+    def __init__(self, index, relation, shared_reads=None):
+        """
+        :param index: position of the relation in the set, type(int)
+        :param relation: instance of CasesRelationShip, type(object)
+        :param shared_reads: variables referenced by the set config (base url, headers), type(set)
+        """
+        case = relation.cases
+        self.index = index
+        self.relation = relation
+        self.reads = references(case.url) | references(case.headers) | references(case.body)
+        self.reads |= shared_reads or set()
+        # variables of a case shadow the run, only extracted variables are seen by other cases
+        self.reads -= set((case.variables or {}).keys())
+        self.writes = {extract.get('name') for extract in case.extracts or [] if extract.get('name')}
+        self.children = []
+        self.parents = 0
+        self.started = False
+
+    def depends_on(self, other):
+        return bool(self.reads & other.writes or self.writes & other.reads or self.writes & other.writes)
+
+
+class DependencyGraph(object):
+    def __init__(self, relations, shared_reads=None):
+        """
+        Cases depend on every earlier case that writes a variable they read, reads a variable they write
+        or writes the same variable, so running the graph sees the variables the sequential order would.
+        :param relations: ordered instances of CasesRelationShip, type(list)
+        :param shared_reads: variables referenced by the set config, type(set)
+        """
+        self.nodes = [Node(index, relation, shared_reads)
+                      for index, relation in enumerate(relations)]
+        for index, node in enumerate(self.nodes):
+            for earlier in self.nodes[:index]:
+                if node.depends_on(earlier):
+                    earlier.children.append(node)
+                    node.parents += 1
+        # relations never started because the run was stopped
+        self.skipped = []
+
+    def _worker(self, func, pending, done):
+        try:
+            while True:
+                node = pending.get()
+                if node is None:
+                    break
+                try:
+                    error = func(node.relation)
+                except BaseException as e:
+                    # ParseResponseErr is not an Exception, a worker dying without an answer would block run()
+                    error = repr(e)
+                done.put((node, error))
+        finally:
+            # every worker thread holds its own database connection
+            connection.close()
+
+    def _dispatch(self, node, pending):
+        node.started = True
+        pending.put(node)
+
+    def run(self, func, workers, stop=None):
+        """
+        Run func for every relation as soon as the relations it depends on are finished
+        :param func: callable receiving a relation, returns error message or None
+        :param workers: max number of relations running at the same time, type(int)
+        :param stop: callable receiving a finished relation and its error, no relation is started after it
+                     returns True, relations already running are waited for
+        :return: error messages in relation order, type(list)
+        """
+        pending = queue.Queue()
+        done = queue.Queue()
+        errors = {}
+        workers = max(1, min(workers, len(self.nodes)))
+        threads = [threading.Thread(target=self._worker, args=(func, pending, done), daemon=True)
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        stopped = False
+        try:
+            for node in self.nodes:
+                if not node.parents:
+                    self._dispatch(node, pending)
+
+            running = len([node for node in self.nodes if node.started])
+            while running:
+                node, error = done.get()
+                running -= 1
+                if error:
+                    errors[node.index] = error
+                if stopped or stop is not None and stop(node.relation, error):
+                    stopped = True
+                    continue
+                for child in node.children:
+                    child.parents -= 1
+                    if not child.parents:
+                        self._dispatch(child, pending)
+                        running += 1
+        finally:
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+        self.skipped = [node.relation for node in self.nodes if not node.started]
+        logger.info("parallel run finished, cases: {}, workers: {}, failed: {}, skipped: {}".format(
+            len(self.nodes), workers, len(errors), len(self.skipped)))
+        return [errors[index] for index in sorted(errors)]
@@ -1,3 +1,6 @@
+from rest_framework.exceptions import APIException
+
+
 class ResponseError(BaseException):
     pass
 
@@ -16,3 +19,9 @@ class RunTestSetError(BaseException):
 
 class FindElementFailedException(Exception):
     pass
+
+
+class Conflict(APIException):
+    status_code = 409
+    default_detail = 'already running'
+    default_code = 'conflict'
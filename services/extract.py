@@ -1,8 +1,8 @@
 import re
-import json
 import logging
 
 from services.exceptions import ParseResponseErr
+from services.response import Body
 
 
 logger = logging.getLogger()
@@ -11,23 +11,45 @@ logger = logging.getLogger()
 class Extractor:
     @classmethod
     def extractor(cls, contents, **kwargs):
-        assert isinstance(contents, str), "ValueError: The type of content is not string"
+        """
+        :param contents: string, or object of Body which is parsed as json only once
+        """
+        if not isinstance(contents, Body):
+            assert isinstance(contents, str), "ValueError: The type of content is not string"
+            contents = Body(contents)
 
         match_type = kwargs.get('match_type')
         if match_type == 'regular':
-            return cls.regular_extractor(contents, **kwargs)
+            return cls.regular_extractor(contents.text, **kwargs)
         elif match_type == 'json':
-            contents = json.loads(contents)
-            return cls.json_path_extractor(contents, **kwargs)
+            return cls.json_path_extractor(contents.json(), **kwargs)
         else:
             raise TypeError("The value of match_type should be 'regular' or 'json', but '{}'".format(match_type))
 
     @classmethod
-    def regular_extractor(cls, str_content, **kwargs):
+    def compile(cls, kwargs):
+        """
+        Compile the expression of an extractor once, the result is passed to extractor as keyword arguments
+        :param kwargs: extractor or assertion, type(dict)
+        :return: kwargs with the compiled regular expression or the tokenized json path, type(dict)
+        """
+        match_type = kwargs.get('match_type')
+        try:
+            if match_type == 'regular':
+                return dict(kwargs, pattern=re.compile(kwargs.get('expression')))
+            elif match_type == 'json':
+                return dict(kwargs, keys=cls.parser_extractor(kwargs.get('expression')))
+        except (AssertionError, TypeError, re.error) as e:
+            # an invalid expression fails the same way when the extractor runs
+            logger.warning("compile expression failed: {}".format(e))
+        return kwargs
+
+    @classmethod
+    def regular_extractor(cls, str_content, pattern=None, **kwargs):
         list_item = kwargs.get('group', '')
         tuple_item = kwargs.get('match_no', '')
 
-        pattern = re.compile(kwargs.get('expression'))
+        pattern = pattern or re.compile(kwargs.get('expression'))
         result = pattern.findall(str_content)
         logger.info("regular match result: {}".format(result))
 
@@ -39,7 +61,7 @@ class Extractor:
             return result
 
     @classmethod
-    def json_path_extractor(cls, json_content, **kwargs):
+    def json_path_extractor(cls, json_content, keys=None, **kwargs):
         """
         Do an xpath-like query with json_content.
         @param (json_content) json_content
@@ -60,7 +82,8 @@ class Extractor:
         @return queried result
         """
         assert isinstance(json_content, (list, dict)), "TypeError: The type of content is not a list or dict"
-        keys = cls.parser_extractor(kwargs.get('expression'))
+        if keys is None:
+            keys = cls.parser_extractor(kwargs.get('expression'))
         try:
             for key in keys:
                 if isinstance(json_content, list):
@@ -0,0 +1,43 @@
+import logging
+from redis import RedisError
+from cronus.settings import RESULT_LIVE_TTL
+from services.models import Histories
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+
+def failures_key(batch):
+    return 'cronus:failures:{}'.format(batch)
+
+
+def record_failure(batch):
+    """
+    Count a failed set of a task run, sets of the run share the counter through redis
+    :param batch: batch of the task run, type(string)
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline()
+        pipe.incr(failures_key(batch))
+        pipe.expire(failures_key(batch), RESULT_LIVE_TTL)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("count failed set of batch {} failed: {}".format(batch, e))
+
+
+def failure_count(batch):
+    """
+    :param batch: batch of the task run, type(string)
+    :return: number of failed sets of the task run, counted from the histories when redis is unavailable, type(int)
+    """
+    client = get_redis()
+    if client is not None:
+        try:
+            return int(client.get(failures_key(batch)) or 0)
+        except RedisError as e:
+            logger.warning("read failed sets of batch {} failed: {}".format(batch, e))
+    return Histories.objects.filter(batch=batch, task_sets__isnull=False, result='Failed').count()
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from redis import RedisError
+from cronus.settings import HEARTBEAT_INTERVAL, RESULT_LIVE_TTL
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+
+def heartbeat_key(batch):
+    return 'cronus:heartbeat:{}'.format(batch)
+
+
+def process_stat(pid):
+    """
+    :param pid: id of the process, type(int)
+    :return: fields of /proc/<pid>/stat after the name of the process, None when the process is gone, type(list)
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the name is in parentheses and may contain spaces
+    return stat.rsplit(')', 1)[1].split()
+
+
+def process_start(pid):
+    """
+    :return: start time of the process in clock ticks after boot, tells the process from a later one reusing its
+             pid, None when the process is gone, type(int)
+    """
+    stat = process_stat(pid)
+    return int(stat[19]) if stat else None
+
+
+def driver_pids(context):
+    """
+    :param context: context of the run, type(RunContext)
+    :return: [pid, start time] of the web driver and of the browser of the run, type(list)
+    """
+    driver = context.driver if context is not None else None
+    if driver is None:
+        return []
+    pids = []
+    process = getattr(getattr(driver, 'service', None), 'process', None)
+    if process is not None:
+        pids.append(process.pid)
+    browser = (getattr(driver, 'capabilities', None) or {}).get('moz:processID')
+    if browser:
+        pids.append(browser)
+    return [[pid, process_start(pid)] for pid in pids]
+
+
+def touch(batch, name='dispatch', queued=True):
+    """
+    Beat once for a run which is sent to its queue, e.g. a task sending its next chunk of sets. Until a worker
+    beats after it, the run is taken as waiting in the queue, see services.reaper
+    """
+    Heartbeat(batch, name=name, queued=queued).beat()
+
+
+def beats(batch):
+    """
+    :param batch: batch of the run, type(string)
+    :return: latest beat of every worker of the run keyed by the name of the beat, None when redis is unavailable,
+             type(dict)
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        records = client.hgetall(heartbeat_key(batch))
+    except RedisError as e:
+        logger.warning("read heartbeats of batch {} failed: {}".format(batch, e))
+        return None
+    return {key: json.loads(value) for key, value in records.items()}
+
+
+class Heartbeat(object):
+    """
+    Beats every HEARTBEAT_INTERVAL seconds from a daemon thread while a run is in flight, so the reaper can tell
+    a run whose worker was killed from a run which is still going. Runs of many workers (the sets of a task)
+    beat under the same batch, each worker process with its own name. Without redis nothing is beaten.
+    """
+
+    def __init__(self, batch, context=None, interval=HEARTBEAT_INTERVAL, name=None, queued=False):
+        """
+        :param batch: batch of the run, type(string)
+        :param context: context of the run, the pids of its browser are sent with the beats, type(RunContext)
+        :param interval: seconds between two beats, type(float)
+        :param name: name of the beat, host and pid of the worker process when None, type(string)
+        :param queued: the beat is sent with the run to its queue, not by a worker of the run, type(bool)
+        """
+        self.batch = batch
+        self.context = context
+        self.interval = interval
+        self.name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.queued = queued
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def beat(self):
+        client = get_redis()
+        if client is None:
+            return False
+        record = {
+            'time': time.time(),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'drivers': driver_pids(self.context),
+            'queued': self.queued
+        }
+        try:
+            pipe = client.pipeline()
+            pipe.hset(heartbeat_key(self.batch), self.name, json.dumps(record))
+            pipe.expire(heartbeat_key(self.batch), RESULT_LIVE_TTL)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("heartbeat of batch {} failed: {}".format(self.batch, e))
+        return True
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def start(self):
+        if self.beat():
+            self.thread = threading.Thread(target=self._loop, name='heartbeat-{}'.format(self.batch), daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        The last beat is kept, it covers the sets of the same task still waiting in the queue
+        """
+        self.stopped.set()
+        if self.thread is None:
+            return
+        self.thread.join()
+        self.thread = None
+        self.context = None
+        self.beat()
@@ -0,0 +1,228 @@
+import math
+import time
+import logging
+import threading
+from bisect import bisect_left
+from django.db import connection
+from django.utils import timezone
+from cronus.settings import LOAD_PROGRESS_INTERVAL
+from services.models import Cases, Sets
+from services.runner import CasesRunner
+from services.context import RunContext
+from services.configs import ConfigCache
+from services.heartbeat import Heartbeat
+from services.progress import Progress
+from services.exceptions import ParseResponseErr
+from services import locks
+
+
+logger = logging.getLogger()
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class LoadStats(object):
+    def __init__(self, max_samples=10):
+        self.latencies = []
+        self.errors = 0
+        self.samples = {}
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+
+    def add(self, latency, error=None):
+        with self.lock:
+            self.latencies.append(latency)
+            if error:
+                self.errors += 1
+                if error in self.samples or len(self.samples) < self.max_samples:
+                    self.samples[error] = self.samples.get(error, 0) + 1
+
+    @staticmethod
+    def _percentile(values, percent):
+        # nearest-rank percentile, values must be sorted
+        index = max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)
+        return round(values[index], 3)
+
+    @staticmethod
+    def _histogram(values):
+        counts = [0] * (len(BUCKETS) + 1)
+        for value in values:
+            counts[bisect_left(BUCKETS, value)] += 1
+        return [{'le': le, 'count': count} for le, count in zip(BUCKETS + ('+Inf',), counts)]
+
+    def counts(self):
+        """
+        :return: requests and errors so far, type(dict)
+        """
+        with self.lock:
+            return {'requests': len(self.latencies), 'errors': self.errors}
+
+    def error_message(self):
+        return '; '.join('{} (x{})'.format(error, count) for error, count in self.samples.items()) or None
+
+    def summary(self, elapsed):
+        """
+        :param elapsed: wall time of the load run in seconds, type(float)
+        :return: fields of LoadSummary, type(dict)
+        """
+        values = sorted(self.latencies)
+        total = len(values)
+        ret = {
+            'requests': total,
+            'errors': self.errors,
+            'error_rate': total and round(self.errors / total, 4),
+            'throughput': elapsed and round(total / elapsed, 3),
+            'histogram': self._histogram(values)
+        }
+        if values:
+            ret['p50'] = self._percentile(values, 50)
+            ret['p90'] = self._percentile(values, 90)
+            ret['p99'] = self._percentile(values, 99)
+            ret['minimum'] = round(values[0], 3)
+            ret['maximum'] = round(values[-1], 3)
+            ret['mean'] = round(sum(values) / total, 3)
+        return ret
+
+
+class LoadRunner(object):
+    def __init__(self, obj_id, batch, target='cases', concurrency=1, rate=None, duration=None, iterations=None,
+                 cassette=None):
+        """
+        :param obj_id: id of the test case or test set, type(string)
+        :param batch: id of the load run, type(string)
+        :param target: must be cases or sets, type(string)
+        :param concurrency: number of virtual users, type(int)
+        :param rate: max iterations started per second over all virtual users, type(float)
+        :param duration: stop starting iterations after this many seconds, type(int)
+        :param iterations: stop after this many iterations over all virtual users, type(int)
+        :param cassette: must be None、record or replay, type(string)
+        """
+        assert target in ('cases', 'sets'), "target not in ('cases', 'sets')"
+        self.batch = batch
+        self.target = target
+        self.concurrency = max(1, concurrency or 1)
+        self.rate = rate
+        self.duration = duration
+        self.iterations = iterations
+        self.cassette = cassette
+        self.stats = LoadStats()
+        self.progress = Progress(batch)
+        self.started = 0
+        self.deadline = None
+        self.next_slot = None
+        self.lock = threading.Lock()
+
+        if target == 'cases':
+            self.instance = Cases.objects.get(pk=obj_id)
+            self.config = ConfigCache.get(self.instance.project_id, self.instance.category)
+            self.setup_cases, self.cases, self.teardown_cases = [], [self.instance], []
+        else:
+            self.instance = Sets.objects.get(pk=obj_id)
+            self.config = ConfigCache.get(self.instance.project_id, self.instance.category, self.instance.id)
+            relations = list(self.instance.relations.filter(tasks_id=None, level='sets').select_related('cases')
+                             .order_by('order'))
+            self.setup_cases = [relation.cases for relation in relations if relation.handler == 'setup']
+            self.cases = [relation.cases for relation in relations if relation.handler is None]
+            self.teardown_cases = [relation.cases for relation in relations if relation.handler == 'teardown']
+
+    def _acquire(self):
+        """
+        Reserve the next iteration, waiting for its slot when an arrival rate is set
+        :return: False once the iteration count or the duration is reached
+        """
+        slot = None
+        with self.lock:
+            if self.iterations and self.started >= self.iterations:
+                return False
+            if self.deadline and time.monotonic() >= self.deadline:
+                return False
+            self.started += 1
+            if self.rate:
+                now = time.monotonic()
+                slot = max(self.next_slot or now, now)
+                self.next_slot = slot + 1.0 / self.rate
+
+        if slot:
+            delay = slot - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return not (self.deadline and time.monotonic() >= self.deadline)
+
+    def _case(self, instance, context, measure=True):
+        start = time.perf_counter()
+        try:
+            runner = CasesRunner(instance, self.batch, context=context, category='api')
+            # every iteration sends the request once, retries would hide the real latency
+            runner.cycle = 1
+            runner.execute()
+            error = runner.error
+        except (Exception, ParseResponseErr) as e:
+            # a virtual user must not die on an error of its case, the error is counted
+            error = repr(e)
+        if measure:
+            self.stats.add((time.perf_counter() - start) * 1000, error)
+
+    def _user(self, index):
+        context = RunContext('{}-{}'.format(self.batch, index), self.config, cassette=self.cassette)
+        try:
+            for case in self.setup_cases:
+                self._case(case, context, measure=False)
+            while self._acquire():
+                for case in self.cases:
+                    self._case(case, context)
+            for case in self.teardown_cases:
+                self._case(case, context, measure=False)
+        finally:
+            context.release()
+            # every virtual user holds its own database connection
+            connection.close()
+
+    def run(self):
+        heartbeat = Heartbeat(self.batch).start()
+        result = 'Failed'
+        try:
+            result = self._run()
+        finally:
+            heartbeat.stop()
+            locks.release('load', self.instance.id, self.batch)
+            self.progress.done(result)
+
+    def _publish(self, status, **fields):
+        self.progress.publish('load', target=self.target, id=self.instance.id, status=status, **fields)
+
+    def _wait(self, threads):
+        """
+        Wait for the virtual users, publishing the requests and errors so far every LOAD_PROGRESS_INTERVAL seconds
+        """
+        published = time.monotonic()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(max(published + LOAD_PROGRESS_INTERVAL - time.monotonic(), 0))
+                if time.monotonic() >= published + LOAD_PROGRESS_INTERVAL:
+                    published = time.monotonic()
+                    self._publish('Starting', **self.stats.counts())
+
+    def _run(self):
+        logger.info("load run, {}: {}, concurrency: {}, rate: {}, duration: {}, iterations: {}".format(
+            self.target, self.instance.id, self.concurrency, self.rate, self.duration, self.iterations))
+        start = time.monotonic()
+        if self.duration:
+            self.deadline = start + self.duration
+
+        threads = [threading.Thread(target=self._user, args=(index,), daemon=True) for index in range(self.concurrency)]
+        self._publish('Starting', requests=0, errors=0)
+        for thread in threads:
+            thread.start()
+        self._wait(threads)
+
+        summary = self.stats.summary(time.monotonic() - start)
+        logger.info("load run finished, batch: {}, summary: {}".format(self.batch, summary))
+        result = self.stats.errors and 'Failed' or 'Succeed'
+        self.instance.load.filter(batch=self.batch).update(status='Done', result=result,
+                                                           error_message=self.stats.error_message(),
+                                                           end_time=timezone.now(), concurrency=self.concurrency,
+                                                           rate=self.rate, duration=self.duration,
+                                                           iterations=self.iterations, **summary)
+        self._publish('Done', result=result, **summary)
+        return result
@@ -0,0 +1,66 @@
+from django.db.models import Q, Case, When, Value, IntegerField
+
+
+SETUP, MAIN, TEARDOWN = 0, 1, 2
+# relations fetched from the database at a time
+CHUNK_SIZE = 500
+
+
+class PlanLoader(object):
+    """
+    Relations of a set run with their cases, loaded by one query ordered by phase and streamed in chunks
+    """
+
+    def __init__(self, set_instance, level='sets', task_id=None, relations=None):
+        """
+        :param set_instance: instance of test sets, type(object)
+        :param level: must be sets or tasks, type(string)
+        :param task_id: id of tasks, type(string)
+        :param relations: ids of the main relations to run, every main relation when None, type(list)
+        """
+        main = Q(handler__isnull=True)
+        if relations is not None:
+            main &= Q(id__in=relations)
+        queryset = set_instance.relations.filter(
+            main | Q(handler__in=('setup', 'teardown')), tasks_id=task_id, level=level
+        ).select_related('cases').annotate(
+            phase=Case(When(handler='setup', then=Value(SETUP)), When(handler='teardown', then=Value(TEARDOWN)),
+                       default=Value(MAIN), output_field=IntegerField())
+        ).order_by('phase', 'order')
+        self.relations = queryset.iterator(chunk_size=CHUNK_SIZE)
+        self.current = None
+        # relations passed over because an earlier phase failed
+        self.skipped = []
+
+    def _peek(self):
+        if self.current is None:
+            self.current = next(self.relations, None)
+        return self.current
+
+    def _take(self, phase):
+        while True:
+            relation = self._peek()
+            if relation is None or relation.phase > phase:
+                return
+            self.current = None
+            if relation.phase < phase:
+                self.skipped.append(relation)
+                continue
+            yield relation
+
+    def setup(self):
+        return self._take(SETUP)
+
+    def main(self):
+        return self._take(MAIN)
+
+    def teardown(self):
+        return self._take(TEARDOWN)
+
+    def drain(self):
+        """
+        Pass over every relation not taken yet
+        """
+        for _ in self._take(TEARDOWN + 1):
+            pass
+        return self.skipped
@@ -0,0 +1,81 @@
+import logging
+from redis import RedisError
+from django.db.models import Sum
+from cronus.settings import RUN_LOCK_TTL, RUN_LOCK_MIN_TTL, RUN_LOCK_TTL_FACTOR
+from services.models import Sets
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def lock_key(level, obj_id):
+    return 'cronus:run:{}:{}'.format(level, obj_id)
+
+
+def lock_ttl(level, obj_id):
+    """
+    :return: seconds a run is expected to take times RUN_LOCK_TTL_FACTOR, RUN_LOCK_TTL when it never ran, type(int)
+    """
+    if level == 'sets':
+        expected = Sets.objects.filter(pk=obj_id).values_list('duration_ema', flat=True).first()
+    elif level == 'tasks':
+        expected = Sets.objects.filter(tasks__id=obj_id).aggregate(total=Sum('duration_ema'))['total']
+    elif level == 'cases':
+        return RUN_LOCK_MIN_TTL
+    else:
+        expected = None
+    if not expected:
+        return RUN_LOCK_TTL
+    return int(max(RUN_LOCK_MIN_TTL, expected * RUN_LOCK_TTL_FACTOR))
+
+
+def acquire(level, obj_id, batch):
+    """
+    :param level: must be cases、sets、tasks or load, type(string)
+    :param obj_id: id of the case, set or task, type(string)
+    :param batch: id of the run taking the lock, type(string)
+    :return: True when taken, False when another run holds it, None when redis is unavailable
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        return bool(client.set(lock_key(level, obj_id), str(batch), nx=True, ex=lock_ttl(level, obj_id)))
+    except RedisError as e:
+        logger.warning("take run lock of {} {} failed: {}".format(level, obj_id, e))
+        return None
+
+
+def release(level, obj_id, batch):
+    """
+    Release the lock only when it is still held by the run, a lock expired and taken by a later run is kept
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.eval(RELEASE_SCRIPT, 1, lock_key(level, obj_id), str(batch))
+    except RedisError as e:
+        logger.warning("release run lock of {} {} failed: {}".format(level, obj_id, e))
+
+
+def holder(level, obj_id):
+    """
+    :return: batch of the run holding the lock, None when the lock is free or redis is unavailable, type(string)
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        return client.get(lock_key(level, obj_id))
+    except RedisError as e:
+        logger.warning("read run lock of {} {} failed: {}".format(level, obj_id, e))
+        return None
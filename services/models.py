@@ -12,6 +12,8 @@ class Projects(models.Model):
     createTime = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updateTime = models.DateTimeField(auto_now=True, verbose_name="更新时间")
     description = models.TextField(null=True, blank=True, verbose_name="描述信息")
+    history_count = models.IntegerField(default=10, verbose_name="保留历史记录数")
+    history_days = models.IntegerField(null=True, blank=True, verbose_name="保留历史记录天数")
 
     class Meta:
         verbose_name = "项目"
@@ -38,6 +40,7 @@ class Tasks(models.Model):
     createTime = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updateTime = models.DateTimeField(auto_now=True, verbose_name="更新时间")
     category = models.CharField(max_length=10, choices=(('api', 'api'), ('ui', 'ui')), default='api', verbose_name="类别")
+    failure_threshold = models.PositiveIntegerField(null=True, blank=True, verbose_name="失败多少个测试集后取消其余测试集")
 
     class Meta:
         verbose_name = "测试任务"
@@ -70,6 +73,13 @@ class Sets(models.Model):
     description = models.TextField(null=True, blank=True, verbose_name="描述信息")
     category = models.CharField(max_length=10, choices=(('api', 'api'), ('ui', 'ui')), default='api', verbose_name="类别")
     project = models.ForeignKey(Projects, on_delete=models.CASCADE, db_column='project')
+    parallel = models.BooleanField(default=False, verbose_name="是否并发执行")
+    workers = models.IntegerField(default=4, verbose_name="并发数")
+    parameters = models.JSONField(null=True, blank=True, verbose_name="参数表")
+    parameter_counter = models.ForeignKey('Counter', on_delete=models.SET_NULL, null=True, blank=True,
+                                          related_name='parameter_sets', verbose_name="参数计数器")
+    parameter_concurrency = models.IntegerField(default=1, verbose_name="参数并发数")
+    duration_ema = models.FloatField(null=True, blank=True, verbose_name="平均执行时长(秒)")
     tasks = models.ManyToManyField(
         Tasks,
         through='SetsRelationShip'
@@ -173,6 +183,7 @@ class Cases(models.Model):
     extracts = models.JSONField(null=True, blank=True, verbose_name="提取参数")
     waitingTime = models.IntegerField(default=10, verbose_name="超时时间")
     continues = models.BooleanField(default=False, verbose_name="失败后是否继续")
+    shareable = models.BooleanField(default=False, verbose_name="前置用例是否在同一批次的测试集间共享")
     cycle = models.IntegerField(default=1, verbose_name="重试次数")
     category = models.CharField(max_length=10, choices=(('api', 'api'), ('ui', 'ui')), default='api', verbose_name="类别")
     procedures = models.JSONField(null=True, blank=True, verbose_name="步骤")
@@ -231,8 +242,11 @@ class Histories(models.Model):
     start_time = models.DateTimeField(null=True, blank=True, verbose_name="开始时间")
     end_time = models.DateTimeField(null=True, blank=True, verbose_name="结束时间")
     response = models.JSONField(null=True, blank=True, verbose_name="请求结果")
+    timing = models.JSONField(null=True, blank=True, verbose_name="耗时明细")
     image = models.ImageField(null=True, blank=True, verbose_name="图片", upload_to='ui/')
     batch = models.UUIDField(null=True, blank=True)
+    parent_batch = models.UUIDField(null=True, blank=True, verbose_name="重新执行的批次")
+    queue_wait = models.FloatField(null=True, blank=True, verbose_name="排队时间(秒)")
     cases = models.ForeignKey(Cases, on_delete=models.CASCADE, null=True, blank=True, db_column='cases', related_name='history')
     sets = models.ForeignKey(Sets, on_delete=models.CASCADE, null=True, blank=True, db_column='sets', related_name='history')
     tasks = models.ForeignKey(Tasks, on_delete=models.CASCADE, null=True, blank=True, db_column='tasks', related_name='history')
@@ -244,12 +258,47 @@ class Histories(models.Model):
         ordering = ['-start_time']
 
 
+class LoadSummary(models.Model):
+    id = models.UUIDField(primary_key=True, auto_created=True, default=uuid4, editable=False)
+    status = models.CharField(max_length=20, null=True, blank=True, verbose_name="状态")
+    result = models.CharField(max_length=20, null=True, blank=True, verbose_name="执行结果")
+    error_message = models.TextField(null=True, blank=True, verbose_name="错误信息")
+    start_time = models.DateTimeField(null=True, blank=True, verbose_name="开始时间")
+    end_time = models.DateTimeField(null=True, blank=True, verbose_name="结束时间")
+    batch = models.UUIDField(null=True, blank=True)
+    concurrency = models.IntegerField(default=1, verbose_name="并发数")
+    rate = models.FloatField(null=True, blank=True, verbose_name="每秒请求速率")
+    duration = models.IntegerField(null=True, blank=True, verbose_name="持续时间")
+    iterations = models.IntegerField(null=True, blank=True, verbose_name="迭代次数")
+    requests = models.IntegerField(default=0, verbose_name="请求数")
+    errors = models.IntegerField(default=0, verbose_name="失败数")
+    error_rate = models.FloatField(null=True, blank=True, verbose_name="错误率")
+    throughput = models.FloatField(null=True, blank=True, verbose_name="吞吐量")
+    p50 = models.FloatField(null=True, blank=True, verbose_name="P50耗时")
+    p90 = models.FloatField(null=True, blank=True, verbose_name="P90耗时")
+    p99 = models.FloatField(null=True, blank=True, verbose_name="P99耗时")
+    minimum = models.FloatField(null=True, blank=True, verbose_name="最小耗时")
+    maximum = models.FloatField(null=True, blank=True, verbose_name="最大耗时")
+    mean = models.FloatField(null=True, blank=True, verbose_name="平均耗时")
+    histogram = models.JSONField(null=True, blank=True, verbose_name="耗时分布")
+    cases = models.ForeignKey(Cases, on_delete=models.CASCADE, null=True, blank=True, db_column='cases',
+                              related_name='load')
+    sets = models.ForeignKey(Sets, on_delete=models.CASCADE, null=True, blank=True, db_column='sets',
+                             related_name='load')
+
+    class Meta:
+        default_permissions = []
+        ordering = ['-start_time']
+
+
 class PeriodicTask(Periodic):
     display = models.CharField(max_length=100, null=True, blank=True, verbose_name="显示名称")
     project = models.ForeignKey(Projects, on_delete=models.CASCADE, db_column='project')
     tasks = models.ForeignKey(Tasks, on_delete=models.DO_NOTHING, verbose_name="任务")
     tags = models.CharField(max_length=50, null=True, blank=True, verbose_name="标签")
     category = models.CharField(max_length=10, choices=(('api', 'api'), ('ui', 'ui')), default='api', verbose_name="类别")
+    overlap = models.CharField(max_length=20, default='skip', verbose_name="上次运行未结束时的处理方式",
+                               choices=(('skip', 'skip'), ('queue', 'queue'), ('concurrent', 'concurrent')))
 
     class Meta:
         verbose_name_plural = '定时任务'
@@ -266,6 +315,23 @@ class PeriodicTask(Periodic):
         return self.name
 
 
+class PeriodicTrigger(models.Model):
+    id = models.UUIDField(primary_key=True, auto_created=True, default=uuid4, editable=False)
+    periodic = models.ForeignKey(PeriodicTask, on_delete=models.CASCADE, null=True, blank=True, db_column='periodic',
+                                 related_name='triggers')
+    tasks = models.ForeignKey(Tasks, on_delete=models.CASCADE, db_column='tasks', related_name='triggers')
+    time = models.DateTimeField(verbose_name="触发时间")
+    decision = models.CharField(max_length=20, choices=(('started', 'started'), ('skipped', 'skipped'),
+                                                        ('queued', 'queued'), ('coalesced', 'coalesced')),
+                                verbose_name="处理结果")
+    batch = models.UUIDField(null=True, blank=True)
+    message = models.TextField(null=True, blank=True, verbose_name="说明")
+
+    class Meta:
+        default_permissions = []
+        ordering = ['-time']
+
+
 class CrontabSchedule(Cron):
     display = models.CharField(max_length=100, null=True, blank=True, verbose_name="显示名称")
     name = models.CharField(max_length=50, verbose_name="名称")
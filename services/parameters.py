@@ -0,0 +1,42 @@
+import io
+import csv
+
+
+def parse_csv(content):
+    """
+    :param content: csv file, the first line holds the variable names, type(bytes)
+    :return: one dict of variables per line, type(list)
+    """
+    text = content.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames:
+        raise ValueError('the csv file has no header')
+    return [{key: value for key, value in row.items() if key} for row in reader]
+
+
+def validate_rows(rows):
+    """
+    :param rows: parameter rows of a set, type(list)
+    """
+    if rows is None:
+        return rows
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('parameters should be a list of objects')
+    return rows
+
+
+def expand_rows(set_instance, counter=None):
+    """
+    Every parameter row combined with every value of the parameter counter, over the counter of the task
+    :param set_instance: instance of test sets, type(object)
+    :param counter: counter of the task, type(dict)
+    :return: variables of every run of the set, None when the set has no parameters, type(list)
+    """
+    rows = [dict(row) for row in set_instance.parameters or []]
+    parameter_counter = set_instance.parameter_counter
+    if parameter_counter:
+        values = range(parameter_counter.initial, parameter_counter.final, parameter_counter.step)
+        rows = [dict(row, **{parameter_counter.name: str(value)}) for row in rows or [{}] for value in values]
+    if not rows:
+        return None
+    return [dict(counter or {}, **row) for row in rows]
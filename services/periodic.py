@@ -0,0 +1,63 @@
+import logging
+from redis import RedisError
+from django.utils import timezone
+from services.models import PeriodicTrigger
+from services.utils import get_redis
+from services import locks
+
+
+logger = logging.getLogger()
+
+OVERLAP_SKIP = 'skip'
+OVERLAP_QUEUE = 'queue'
+OVERLAP_CONCURRENT = 'concurrent'
+
+
+def pending_key(task_id):
+    return 'cronus:pending:tasks:{}'.format(task_id)
+
+
+def mark_pending(task_id, periodic_id):
+    """
+    Keep at most one periodic run of a task waiting for the run in flight, the marker expires with the run lock
+    :param task_id: id of the task, type(string)
+    :param periodic_id: id of the periodic task started when the run in flight is done, type(int)
+    :return: True when marked, False when a run is already waiting, None when redis is unavailable
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        return bool(client.set(pending_key(task_id), str(periodic_id), nx=True, ex=locks.lock_ttl('tasks', task_id)))
+    except RedisError as e:
+        logger.warning("mark pending run of task {} failed: {}".format(task_id, e))
+        return None
+
+
+def pop_pending(task_id):
+    """
+    :param task_id: id of the task, type(string)
+    :return: id of the periodic task waiting for the task, None when no run is waiting, type(string)
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline()
+        pipe.get(pending_key(task_id))
+        pipe.delete(pending_key(task_id))
+        periodic_id, _ = pipe.execute()
+    except RedisError as e:
+        logger.warning("read pending run of task {} failed: {}".format(task_id, e))
+        return None
+    return periodic_id
+
+
+def record_trigger(task_id, periodic_id, decision, batch=None, message=None):
+    """
+    :param decision: must be started、skipped、queued or coalesced, type(string)
+    :param batch: batch of the run started by the trigger, type(string)
+    """
+    logger.info("periodic task: {}, task: {}, trigger {}, {}".format(periodic_id, task_id, decision, message or ''))
+    return PeriodicTrigger.objects.create(tasks_id=task_id, periodic_id=periodic_id, time=timezone.now(),
+                                          decision=decision, batch=batch, message=message)
@@ -12,17 +12,20 @@ logger = logging.getLogger()
 
 
 class Procedures(object):
-    class_variables = {}
-
-    def __init__(self, contents, key=None, proxy=None):
+    def __init__(self, contents, context, proxy=None):
+        """
+        :param contents: steps of the case, type(list)
+        :param context: context of the run, holds the web driver, type(RunContext)
+        :param proxy: type(dict)
+        """
         self.contents = contents
-        self.key = key
+        self.context = context
         self.proxy = proxy
 
     def _open(self, browser, url):
         driver = WebDriver(self.proxy, browser).driver()
         driver.set_window_size(1366, 768)
-        self.class_variables[self.key]['driver'] = driver
+        self.context.driver = driver
         driver.get(url)
 
     @staticmethod
@@ -37,22 +40,22 @@ class Procedures(object):
                 "find element failed, {} {}".format(class_name, condition))
 
     def _input(self, strategy, ele_value, input_value):
-        driver = self.class_variables.get(self.key).get('driver')
+        driver = self.context.driver
         ele = FindElement(driver, strategy, ele_value).find_element()
         ele.clear()
         ele.send_keys(input_value)
 
     def _click(self, strategy, ele_value):
-        driver = self.class_variables.get(self.key).get('driver')
+        driver = self.context.driver
         ele = FindElement(driver, strategy, ele_value).find_element()
         ele.click()
 
     def _scroll(self, strategy, abscissa, ordinate):
-        driver = self.class_variables.get(self.key).get('driver')
+        driver = self.context.driver
         Scroll(driver, strategy, abscissa, ordinate).scroll()
 
     def _close(self):
-        driver = self.class_variables.get(self.key).get('driver')
+        driver = self.context.driver
         driver.quit()
 
     def parse(self):
@@ -70,7 +73,7 @@ class Procedures(object):
                     args = inspect.getfullargspec(
                         getattr(expected_conditions, class_name)).args[1:]
                     first_args = args[0]
-                    driver = self.class_variables.get(self.key).get('driver')
+                    driver = self.context.driver
                     if first_args == 'locator':
                         locator_strategy = locator.get(
                             content.get('locator_strategy'))
@@ -0,0 +1,48 @@
+import json
+import time
+import logging
+from redis import RedisError
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+PROGRESS_PREFIX = 'cronus:progress:'
+
+
+def progress_channel(batch):
+    return '{}{}'.format(PROGRESS_PREFIX, batch)
+
+
+class Progress(object):
+    """
+    Publishes the state changes of a run to the redis channel of its batch, clients of the progress stream get
+    them without polling the histories. Publishing stops at the first redis error, the histories are not affected.
+    """
+
+    def __init__(self, batch):
+        """
+        :param batch: batch of the run, type(string)
+        """
+        self.batch = batch
+        self.enabled = True
+
+    def publish(self, event, **fields):
+        """
+        :param event: must be case、set、skip、task、load or done, done ends the stream of the batch, type(string)
+        :param fields: state of the case, set, task or load run, type(dict)
+        """
+        client = get_redis() if self.enabled else None
+        if client is None:
+            self.enabled = False
+            return
+        message = dict(fields, event=event, batch=str(self.batch), time=time.time())
+        try:
+            client.publish(progress_channel(self.batch), json.dumps(message, default=str))
+        except RedisError as e:
+            logger.warning("publish progress of batch {} failed, progress is not published: {}".format(
+                self.batch, e))
+            self.enabled = False
+
+    def done(self, result):
+        self.publish('done', result=result)
@@ -0,0 +1,163 @@
+import os
+import signal
+import socket
+import logging
+from datetime import timedelta
+from redis import RedisError
+from django.db.models import Min
+from django.utils import timezone
+from cronus.settings import REAPER_GRACE, RUN_LOCK_TTL
+from services.models import Histories, LoadSummary
+from services.buffer import live_key
+from services.utils import get_redis
+from services.progress import Progress
+from services import heartbeat
+from services import locks
+
+
+logger = logging.getLogger()
+
+
+def _started(model, deadline):
+    """
+    :return: start time of the oldest running record of every batch started before the deadline, type(dict)
+    """
+    records = model.objects.filter(status='Starting', start_time__lt=deadline).exclude(batch=None).order_by(
+        ).values('batch').annotate(started=Min('start_time'))
+    # batches are hex strings in redis and in the run locks
+    return {record['batch'].hex: record['started'] for record in records}
+
+
+def _queued(records, now):
+    """
+    :return: the latest beat of the run was sent with the run to its queue less than RUN_LOCK_TTL seconds ago,
+             no worker has taken the run since, type(bool)
+    """
+    if not records:
+        return False
+    latest = max(records.values(), key=lambda record: record['time'])
+    return bool(latest.get('queued')) and latest['time'] > (now - timedelta(seconds=RUN_LOCK_TTL)).timestamp()
+
+
+def orphaned(now=None):
+    """
+    A run is orphaned when it has been running longer than REAPER_GRACE seconds and none of its workers has beaten
+    for REAPER_GRACE seconds. A run waiting in a backlogged queue is not orphaned until RUN_LOCK_TTL seconds after
+    it was sent. Without redis nothing beats, only runs older than RUN_LOCK_TTL are taken as orphaned.
+    :return: batches of the orphaned runs and their beats, type(dict)
+    """
+    now = now or timezone.now()
+    deadline = now - timedelta(seconds=REAPER_GRACE)
+    started = _started(Histories, deadline)
+    for batch, start_time in _started(LoadSummary, deadline).items():
+        started[batch] = min(start_time, started.get(batch, start_time))
+
+    ret = {}
+    for batch, start_time in started.items():
+        records = heartbeat.beats(batch)
+        if records is None:
+            if start_time < now - timedelta(seconds=RUN_LOCK_TTL):
+                ret[batch] = {}
+        elif not any(record['time'] > deadline.timestamp() for record in records.values()) and not _queued(
+                records, now):
+            ret[batch] = records
+    return ret
+
+
+def _tree(pid):
+    """
+    :return: the process and all its descendants, e.g. chromedriver and the chrome processes it started, type(list)
+    """
+    children = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            stat = heartbeat.process_stat(int(name))
+            if stat:
+                children.setdefault(int(stat[1]), []).append(int(name))
+    ret, pending = [], [pid]
+    while pending:
+        pid = pending.pop()
+        ret.append(pid)
+        pending.extend(children.get(pid, []))
+    return ret
+
+
+def _kill(records):
+    """
+    Kill the browsers left by the killed workers of the run, only browsers on this host can be reached. A pid is only
+    killed while it is still the process recorded by the heartbeat, a pid reused by another process is left alone.
+    """
+    host = socket.gethostname()
+    for record in records.values():
+        if record.get('host') != host:
+            if record.get('drivers'):
+                logger.warning("browsers {} of a killed run are left on {}".format(record['drivers'], record['host']))
+            continue
+        for pid, start in record.get('drivers') or []:
+            if start is None or heartbeat.process_start(pid) != start:
+                logger.info("browser process {} of a killed run is gone".format(pid))
+                continue
+            for process in _tree(pid):
+                try:
+                    os.kill(process, signal.SIGKILL)
+                    logger.info("killed browser process {} of a killed run".format(process))
+                except (ProcessLookupError, PermissionError) as e:
+                    logger.info("kill browser process {} failed: {}".format(process, e))
+
+
+def _runs(batch):
+    """
+    :return: level and object id of the runs admitted by Start in the batch, type(list)
+    """
+    runs = []
+    for cases_id, sets_id, tasks_id in Histories.objects.filter(batch=batch, status='Starting').exclude(
+            cases=None, sets=None, tasks=None).values_list('cases_id', 'sets_id', 'tasks_id'):
+        if cases_id:
+            runs.append(('cases', cases_id))
+        elif sets_id:
+            runs.append(('sets', sets_id))
+        else:
+            runs.append(('tasks', tasks_id))
+    for cases_id, sets_id in LoadSummary.objects.filter(batch=batch, status='Starting').values_list(
+            'cases_id', 'sets_id'):
+        runs.append(('load', cases_id or sets_id))
+    return runs
+
+
+def abort(batch, records=None):
+    """
+    Mark the running records of a batch as Aborted, then release the run locks and the browsers of the batch
+    :param batch: batch of the orphaned run, type(string)
+    :param records: beats of the batch, type(dict)
+    :return: level and object id of the runs aborted, type(list)
+    """
+    runs = _runs(batch)
+    end_time = timezone.now()
+    error_msg = 'aborted, the worker of the run stopped beating'
+    Histories.objects.filter(batch=batch, status='Starting').update(status='Done', result='Aborted',
+                                                                    error_message=error_msg, end_time=end_time)
+    LoadSummary.objects.filter(batch=batch, status='Starting').update(status='Done', result='Aborted',
+                                                                      error_message=error_msg, end_time=end_time)
+    for level, obj_id in runs:
+        locks.release(level, obj_id, batch)
+    _kill(records or {})
+
+    client = get_redis()
+    if client is not None:
+        try:
+            client.delete(live_key(batch), heartbeat.heartbeat_key(batch))
+        except RedisError as e:
+            logger.warning("remove live status of batch {} failed: {}".format(batch, e))
+    Progress(batch).done('Aborted')
+    logger.warning("aborted orphaned batch {}, runs: {}".format(batch, runs))
+    return runs
+
+
+def reap(now=None):
+    """
+    :return: batch, level and object id of the runs aborted, type(list)
+    """
+    ret = []
+    for batch, records in orphaned(now).items():
+        ret.extend((batch, level, obj_id) for level, obj_id in abort(batch, records))
+    return ret
@@ -0,0 +1,18 @@
+from services.models import Histories
+
+
+def failed(level, obj_id, batch):
+    """
+    :param level: must be sets or tasks, type(string)
+    :param obj_id: id of the set or the task, type(string)
+    :param batch: batch of the run to rerun, type(string)
+    :return: ids of the sets of the task, or of the case relations of the set, which did not succeed, type(list)
+    """
+    queryset = Histories.objects.filter(batch=batch).exclude(result='Succeed').order_by()
+    if level == 'tasks':
+        ids = queryset.filter(task_sets__tasks_id=obj_id).values_list('task_sets__sets_id', flat=True)
+    else:
+        # setup and teardown are run again anyway
+        ids = queryset.filter(set_cases__sets_id=obj_id, set_cases__level='sets',
+                              set_cases__handler__isnull=True).values_list('set_cases_id', flat=True)
+    return [str(obj) for obj in ids.distinct()]
@@ -0,0 +1,79 @@
+import json
+from django.utils.functional import cached_property
+
+
+class Body(object):
+    """
+    Text of a part of the response, parsed as json at most once
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.parsed = False
+        self.content = None
+        self.error = None
+
+    def json(self):
+        if not self.parsed:
+            self.parsed = True
+            try:
+                self.content = json.loads(self.text)
+            except (ValueError, TypeError) as e:
+                self.error = e
+        if self.error:
+            raise self.error
+        return self.content
+
+
+class ResponseContent(object):
+    """
+    Wrapper of requests.Response shared by assertions, extractors and the recorded result, every part of the
+    response is decoded once
+    """
+
+    def __init__(self, response):
+        """
+        :param response: object of requests.Response
+        """
+        self.response = response
+        self.status_code = response.status_code
+        self.url = response.url
+
+    @cached_property
+    def body(self):
+        return Body(self.response.text)
+
+    @property
+    def text(self):
+        return self.body.text
+
+    def json(self):
+        return self.body.json()
+
+    @cached_property
+    def headers(self):
+        return dict(self.response.headers)
+
+    @cached_property
+    def header_body(self):
+        return Body(json.dumps(self.headers))
+
+    @cached_property
+    def history(self):
+        return [ResponseContent(response) for response in self.response.history]
+
+    def select(self, select, index=None):
+        """
+        :param select: part of the response, must be text、response_header、request_history or request_url
+        :param index: index of the redirect when select is request_history, type(int)
+        :return: object of Body
+        """
+        if select == 'text':
+            return self.body
+        elif select == 'response_header':
+            return self.header_body
+        elif select == 'request_history':
+            return self.history[index].body
+        elif select == 'request_url':
+            return Body(self.url)
+        return Body('')
@@ -0,0 +1,85 @@
+import logging
+from datetime import timedelta
+from django.db.models import Count
+from django.utils import timezone
+from cronus.settings import HISTORY_PRUNE_BATCH
+from services.models import Projects, Histories, LoadSummary, PeriodicTrigger
+from services.storage import remove_histories
+
+
+logger = logging.getLogger()
+
+# owners of histories and the path from the owner to its project
+HISTORY_OWNERS = {
+    'cases': 'cases__project',
+    'sets': 'sets__project',
+    'tasks': 'tasks__project',
+    'set_cases': 'set_cases__sets__project',
+    'task_sets': 'task_sets__tasks__project'
+}
+LOAD_OWNERS = {
+    'cases': 'cases__project',
+    'sets': 'sets__project'
+}
+
+
+def _expired_by_count(queryset, owner, keep):
+    """
+    :return: ids of the records of every owner older than its newest keep records, type(list)
+    """
+    ids = []
+    owners = queryset.exclude(**{owner: None}).order_by().values(owner).annotate(total=Count('id')).filter(
+        total__gt=keep)
+    for record in owners.iterator():
+        ids.extend(queryset.filter(**{owner: record[owner]}).order_by('-start_time').values_list(
+            'id', flat=True)[keep:])
+    return ids
+
+
+def _delete(model, ids):
+    for index in range(0, len(ids), HISTORY_PRUNE_BATCH):
+        queryset = model.objects.filter(id__in=ids[index:index + HISTORY_PRUNE_BATCH])
+        if model is Histories:
+            remove_histories(queryset)
+        else:
+            queryset.delete()
+    return len(ids)
+
+
+def _prune(model, owners, project):
+    deleted = 0
+    for owner, path in owners.items():
+        # running records are never pruned
+        queryset = model.objects.filter(**{path: project}).exclude(status='Starting')
+        if project.history_days:
+            earliest = timezone.now() - timedelta(days=project.history_days)
+            deleted += _delete(model, list(queryset.filter(start_time__lt=earliest).values_list('id', flat=True)))
+        if project.history_count is not None:
+            deleted += _delete(model, _expired_by_count(queryset, owner, project.history_count))
+    return deleted
+
+
+def _prune_triggers(project):
+    if not project.history_days:
+        return 0
+    earliest = timezone.now() - timedelta(days=project.history_days)
+    queryset = PeriodicTrigger.objects.filter(periodic__project=project, time__lt=earliest)
+    return _delete(PeriodicTrigger, list(queryset.values_list('id', flat=True)))
+
+
+def prune_histories():
+    """
+    Delete histories and load summaries beyond the retention of their project, by count and by age, and the
+    triggers of periodic tasks by age
+    :return: number of deleted records, type(int)
+    """
+    deleted = 0
+    for project in Projects.objects.iterator():
+        histories = _prune(Histories, HISTORY_OWNERS, project)
+        loads = _prune(LoadSummary, LOAD_OWNERS, project)
+        triggers = _prune_triggers(project)
+        if histories or loads or triggers:
+            logger.info("project: {}, pruned {} histories, {} load summaries, {} triggers".format(
+                project.name, histories, loads, triggers))
+        deleted += histories + loads + triggers
+    return deleted
@@ -4,56 +4,77 @@ import logging
 import time
 import uuid
 from uuid import uuid5
-from json.decoder import JSONDecodeError
-from requests import Session
 from django.utils import timezone
 from cronus.settings import MEDIA_ROOT
-from services.models import Config, Sets
+from services.models import Sets
 from services.substitute import Parser
-from services.assertion import Asserts
 from services.extract import Extractor
-from services.procedures import Procedures
-from services.utils import remove_file, generate_uuid
+from services.response import ResponseContent
+from services.compiler import PlanCache
+from services.dependency import DependencyGraph, references
+from services.context import RunContext
+from services.configs import ConfigCache
+from services.buffer import ResultBuffer
+from services.loader import PlanLoader
+from services.failures import record_failure, failure_count
+from services.shared import SharedSetup
+from services.heartbeat import Heartbeat
+from services.progress import Progress
+from services.scheduler import record_duration
+from services import timing
+from services import cassette as cassettes
+from services import locks
+from services.storage import store_response
+from services.exceptions import ParseResponseErr
+from services.utils import generate_uuid
 
 
 logger = logging.getLogger()
 
 
 class CasesRunner(object):
-    class_variables = {}
-
-    def __init__(self, instance, batch, level='cases', set_instance=None, order=None, config_instance=None,
-                 handler=None, key=None, counter=None, task_id=None, category='api'):
+    def __init__(self, instance, batch, level='cases', set_instance=None, order=None, handler=None, context=None,
+                 task_id=None, category='api', buffer=None, cassette=None, relation=None, progress=None):
         """
         :param instance: instance of test case, type(object)
         :param batch: run tasks or sets will generate id, which used to record the result of cases, type(string)
         :param level: level of cases, must be cases、sets or tasks, type(string)
         :param set_instance: instance of test sets, type(object)
         :param order: cases order in test sets, type(int)
-        :param config_instance: instance of config, type(object)
         :param handler:  case's label in test sets, must be ''、setup or teardown, type(string)
-        :param key: type(string)
-        :param counter: type(dict)
+        :param context: context of the run the case belongs to, type(RunContext)
         :param task_id: id of tasks , type(string)
         :param category: must be ui、api, type(string)
+        :param buffer: results are written by the buffer of the set run when given, type(ResultBuffer)
+        :param cassette: must be None、record or replay, only used when no context is given, type(string)
+        :param relation: relation of the case in the set when it is already loaded, type(CasesRelationShip)
+        :param progress: state changes are published by the progress of the set run when given, type(Progress)
         """
         self.instance = instance
         self.batch = batch
         self.setInstance = set_instance
         self.orderNum = order
-        self.config_instance = config_instance
         self.level = level
         self.handler = handler
         self.error = None
         self.status = None
         self.result = None
-        self.key = key
-        self.counter = counter
+        # a case run on its own has its own context, released once the case is done
+        self.own_context = context is None
+        self.context = context or RunContext(batch, ConfigCache.get(instance.project_id, category),
+                                             cassette=cassette)
         self.task_id = task_id
         self.category = category
         self.start_time = timezone.now()
         self.ret = None
         self.image_name = None
+        self.timing = None
+        self.buffer = buffer
+        self.history = None
+        self.relation = relation
+        self.progress = progress or Progress(batch)
+
+        self.plan = PlanCache.get(instance)
 
         self._init_variables()
         self._get_relation_ship()
@@ -62,42 +83,10 @@ class CasesRunner(object):
             self._init_data()
 
     def _init_variables_api(self):
-        self.proxy = []
-        if not self.key:
-            self.key = 'case'
-            self.class_variables.setdefault(self.key, {})
-            self.class_variables[self.key].setdefault('variables', {})
-        if self.config_instance:
-            self.class_variables[self.key]['base_url'] = self.config_instance.baseurl
-            self.class_variables[self.key]['headers'] = self.config_instance.headers
-            self.class_variables[self.key]['variables'].update(self.config_instance.variables)
-            self.proxy = self.config_instance.proxy
-        else:
-            ret = Config.objects.filter(globalConfig=1, project=self.instance.project, category=self.category)
-            if ret.exists():
-                config = ret.first()
-                self.class_variables[self.key]['base_url'] = config.baseurl
-                self.class_variables[self.key]['headers'] = config.headers
-                self.class_variables[self.key]['variables'].update(config.variables)
-                self.proxy = config.proxy
-        if self.counter:
-            self.class_variables[self.key]['variables'].update(self.counter)
+        self.proxy = self.context.proxy
 
     def _init_variables_ui(self):
-        if not self.key:
-            self.key = 'case'
-            Procedures.class_variables.setdefault(self.key, {})
-            Procedures.class_variables[self.key].setdefault('variables', {})
-        if self.config_instance:
-            Procedures.class_variables[self.key]['variables'].update(self.config_instance.variables)
-            self.proxy = self.config_instance.proxy
-        else:
-            ret = Config.objects.filter(globalConfig=1, project=self.instance.project, category=self.category)
-            if ret.exists():
-                config = ret.first()
-                Procedures.class_variables[self.key]['variables'].update(config.variables)
-                self.proxy = config.proxy
-
+        self.proxy = self.context.proxy
         self.proxies = {}
         for proxy in self.proxy:
             self.proxies[proxy.get('protocol')] = '{}:{}'.format(
@@ -105,6 +94,8 @@ class CasesRunner(object):
 
     def _init_variables(self):
         assert self.category in ('api', 'ui'), "category not in ('api', 'ui')"
+        # case variables and headers only apply to the case itself
+        self.variables, self.headers = self.context.scope(self.instance.variables, self.instance.headers)
         category = {
             'api': self._init_variables_api,
             'ui': self._init_variables_ui
@@ -113,23 +104,14 @@ class CasesRunner(object):
 
     def _init_data(self):
         self.method = self.instance.method
+        base_url = self.context.base_url
         if self.instance.url.startswith(('http://', 'https://', '$')):
             self.url = self.instance.url
         else:
-            self.url = self.class_variables.get(self.key).get('base_url') and '{}/{}'.format(
-                self.class_variables.get(self.key).get('base_url').rstrip('/'), self.instance.url.lstrip('/')) \
+            self.url = base_url and '{}/{}'.format(base_url.rstrip('/'), self.instance.url.lstrip('/')) \
                        or self.instance.url
 
-        instance_variables = self.instance.variables
-        if instance_variables:
-            self.class_variables[self.key]['variables'].update(instance_variables)
-
-        instance_headers = self.instance.headers
-        if instance_headers:
-            self.class_variables[self.key]['headers'].update(instance_headers)
-
-        self.headers = self.class_variables.get(self.key).get('headers')
-        self.variables = self.class_variables.get(self.key).get('variables')
+        self.url_template = self.plan.url(self.url)
         self.cycle = self.instance.cycle
         self.body = self.instance.body
         self.asserts = self.instance.asserts
@@ -137,14 +119,12 @@ class CasesRunner(object):
         self.time_out = self.instance.waitingTime
 
     def _replace_variables_ui(self):
-        variables = Procedures.class_variables[self.key]['variables']
-        self.procedures = json.loads(Parser(self.instance.procedures, variables).parser())
+        self.procedures = json.loads(Parser(self.plan.procedures, self.variables).parser())
 
     def _replace_variables_api(self):
-        variable = self.class_variables[self.key]['variables']
-        self.url = Parser(self.url, variable=variable).parser()
-        self.headers = json.loads(Parser(self.headers, variable=variable).parser())
-        self.body = Parser(self.body, variable=variable).parser()
+        self.url = Parser(self.url_template, variable=self.variables).parser()
+        self.headers = json.loads(Parser(dict(self.headers), variable=self.variables).parser())
+        self.body = Parser(self.plan.body, variable=self.variables).parser()
 
     @staticmethod
     def _create_dir(file_path):
@@ -153,10 +133,10 @@ class CasesRunner(object):
 
     def _asserts(self, contents):
         error = ''
-        for index, obj in enumerate(self.asserts):
+        for index, assertion in enumerate(self.plan.asserts):
             try:
-                Asserts.asserts(contents, **obj)
-            except Exception as e:
+                assertion.check(contents)
+            except (Exception, ParseResponseErr) as e:
                 self.error = "Failed reason: {}, response message: {}  {}".format(e, contents.status_code,
                                                                                   contents.text)
                 error = "{};  {}".format(self.error, error)
@@ -181,8 +161,8 @@ class CasesRunner(object):
         if self.time_out:
             contents['timeout'] = self.time_out
 
+        proxies = {}
         if self.proxy:
-            proxies = {}
             for proxy in self.proxy:
                 scheme = proxy.get('scheme', '')
                 protocol = proxy.get('protocol', '')
@@ -193,124 +173,161 @@ class CasesRunner(object):
                 proxies[protocol] = "{}://{}:{}@{}:{}".format(scheme, username, password, ip, port)
             contents['proxies'] = proxies
 
-        contents['verify'] = False
-
-        s = Session()
+        s = self.context.sessions.get(proxies=proxies, verify=False)
+        if self.context.cassette:
+            cassettes.use(self.instance.id)
 
-        logger.info('request url: {}, method: {}, {}'.format(self.url, self.method, contents))
-        return s.request(method=self.method, url=self.url, **contents)
+        logger.info('request url: {}, method: {}, proxies: {}, {}'.format(self.url, self.method, proxies, contents))
+        # stream the body, so time to first byte and download are measured apart
+        return s.request(method=self.method, url=self.url, stream=True, **contents)
 
     def _extract_variable(self, contents):
         if self.result == "Succeed":
-            for index, con in enumerate(self.extracts):
-                content = ''
-                if con.get('select') == 'text':
-                    content = contents.text
-                elif con.get('select') == 'response_header':
-                    content = json.dumps(dict(contents.headers))
-                elif con.get('select') == 'request_history':
-                    ind = con.get('index')
-                    content = contents.history[ind].text
-                elif con.get('select') == 'request_url':
-                    content = contents.url
-                self.class_variables[self.key]['variables'][con.get('name')] = Extractor.extractor(content, **con)
+            for index, con in enumerate(self.plan.extracts):
+                content = contents.select(con.get('select'), con.get('index'))
+                self.variables[con.get('name')] = Extractor.extractor(content, **con)
 
     def _get_relation_ship(self):
-        if self.level != 'cases':
+        if self.level != 'cases' and self.relation is None:
             self.relation = self.instance.relations.get(sets_id=self.setInstance.id, tasks_id=self.task_id,
                                                         level=self.level, order=self.orderNum, handler=self.handler)
 
+    def _publish(self):
+        self.progress.publish('case', case=self.instance.id, relation=self.relation and self.relation.id,
+                              set=self.setInstance and self.setInstance.id, task=self.task_id,
+                              status=self.status or 'Starting', result=self.result)
+
     def _record_result(self):
-        ret = self.relation.history
-        if ret.count() > 9:
-            instance = ret.earliest('start_time')
-            if instance.image:
-                full_path = os.path.join(MEDIA_ROOT, str(instance.image))
-                remove_file(full_path)
-            instance.delete()
+        self._publish()
+        if self.buffer:
+            self.history = self.buffer.start(self.relation, self.start_time)
+            return
         self.relation.history.create(start_time=self.start_time, status='Starting', batch=self.batch)
 
-    def _update_result(self, end_time, response=None, image=None):
-        self.relation.history.filter(batch=self.batch).update(status=self.status, result=self.result,
-                                                              error_message=self.error, end_time=end_time,
-                                                              response=response, image=image)
+    def _update_result(self, end_time, response=None, image=None, timings=None):
+        result = dict(status=self.status, result=self.result, error_message=self.error, end_time=end_time,
+                      response=response, image=image, timing=timings)
+        if self.buffer:
+            self.buffer.finish(self.history, **result)
+        else:
+            self.relation.history.filter(batch=self.batch).update(**result)
+        self._publish()
         if self.error:
             raise Exception(self.error)
 
     def _save_screen_shot(self):
-        driver = Procedures.class_variables[self.key]['driver']
+        driver = self.context.driver
+        if driver is None:
+            return
         self.image_name = "{}{}{}".format('ui/', generate_uuid(), '.png')
         file_path = '{}/{}'.format(MEDIA_ROOT, self.image_name)
         logger.info("image path: {}".format(file_path))
         self._create_dir(os.path.dirname(file_path))
         driver.get_screenshot_as_file(file_path)
-        driver.quit()
+        self.context.quit_driver()
 
     def _response(self, response):
         ret = {}
         if response is not None:
             ret['status_code'] = response.status_code
-            ret['headers'] = dict(response.headers)
+            ret['headers'] = response.headers
             try:
                 ret['text'] = response.json()
-            except (JSONDecodeError, TypeError):
+            except (ValueError, TypeError):
                 ret['text'] = response.text
         if self.error:
             ret['error'] = self.error
         return ret
 
+    def _attempt(self):
+        """
+        Send the request once and assert the response
+        :return: phase timings of the attempt in milliseconds, type(dict)
+        """
+        attempt = {}
+        timing.reset()
+        start = time.perf_counter()
+        try:
+            response = self._request()
+            received = time.perf_counter()
+            response.content
+            attempt['download'] = timing.milliseconds(time.perf_counter() - received)
+            attempt['connect'] = timing.milliseconds(timing.connect_time())
+            attempt['ttfb'] = timing.milliseconds(max(response.elapsed.total_seconds() - timing.connect_time(), 0))
+            # the body is decoded and parsed once for the assertions, the extractors and the recorded result
+            self.ret = ResponseContent(response)
+            logger.info("response code: {}, response: {}".format(self.ret.status_code, self.ret.text))
+        except Exception as e:
+            logger.error("request failed: {}".format(e))
+            attempt['connect'] = timing.milliseconds(timing.connect_time())
+            self.error = repr(e)
+            self.result = "Failed"
+        else:
+            # assert request result
+            asserted = time.perf_counter()
+            self._asserts(self.ret)
+            attempt['assertion'] = timing.milliseconds(time.perf_counter() - asserted)
+        attempt['total'] = timing.milliseconds(time.perf_counter() - start)
+        return attempt
+
     def _run(self):
         if not self.cycle:
             self.cycle = 1
 
         while self.cycle:
             self.cycle -= 1
-            try:
-                self.ret = self._request()
-                logger.info("response code: {}, response: {}".format(self.ret.status_code, self.ret.text))
-            except Exception as e:
-                logger.error("request failed: {}".format(e))
-                self.error = repr(e)
-                self.result = "Failed"
-            else:
-                # assert request result
-                self._asserts(self.ret)
-                if self.result == "Succeed":
-                    self.error = None
-                    break
-
-    def run_api(self):
-        if self.level != 'cases':
-            self._record_result()
+            self.timing['attempts'].append(self._attempt())
+            if self.result == "Succeed":
+                self.error = None
+                break
+        self.timing['retries'] = len(self.timing['attempts']) - 1
 
+    def execute(self):
+        """
+        Send the request, assert the response and extract variables without recording the result
+        """
+        self.timing = {'attempts': [], 'retries': 0}
+        start = time.perf_counter()
         self._run()
 
         if not self.error:
+            extracted = time.perf_counter()
             try:
                 self._extract_variable(self.ret)
-            except Exception as e:
+            except (Exception, ParseResponseErr) as e:
                 self.error = "{}:  {}".format('extract variable failed', repr(e))
                 self.result = "Failed"
+            self.timing['extraction'] = timing.milliseconds(time.perf_counter() - extracted)
+        self.timing['total'] = timing.milliseconds(time.perf_counter() - start)
+
+    def run_api(self):
+        if self.level != 'cases':
+            self._record_result()
+
+        self.execute()
 
         self.status = "Done"
         end_time = timezone.now()
-        response = self._response(self.ret)
+        response = store_response(self._response(self.ret))
 
         if self.level == 'cases':
             self.instance.history.filter(batch=self.batch).update(status=self.status, result=self.result,
                                                                   error_message=self.error, end_time=end_time,
-                                                                  response=response)
+                                                                  response=response, timing=self.timing)
         else:
-            self._update_result(end_time, response)
+            self._update_result(end_time, response, timings=self.timing)
 
     def run_ui(self):
+        # workers of api runs never import selenium
+        from services.procedures import Procedures
+
         self._replace_variables_ui()
 
         if self.level != 'cases':
             self._record_result()
 
         try:
-            Procedures(self.procedures, self.key, self.proxies).parse()
+            Procedures(self.procedures, self.context, self.proxies).parse()
         except Exception as e:
             logger.error(repr(e))
             self.error = repr(e)
@@ -326,9 +343,6 @@ class CasesRunner(object):
             self.instance.history.filter(batch=self.batch).update(status=self.status, result=self.result,
                                                                   error_message=self.error, end_time=end_time,
                                                                   image=self.image_name)
-
-            driver = Procedures.class_variables[self.key]['driver']
-            driver.quit()
         else:
             self._update_result(end_time, response=None, image=self.image_name)
 
@@ -338,17 +352,33 @@ class CasesRunner(object):
             'api': self.run_api,
             'ui': self.run_ui
         }
-        category.get(self.category)()
+        heartbeat = Heartbeat(self.batch, self.context).start() if self.own_context else None
+        if self.level == 'cases' and self.own_context:
+            self._publish()
+        try:
+            category.get(self.category)()
+        finally:
+            if self.own_context:
+                self.context.release()
+                heartbeat.stop()
+            if self.level == 'cases' and self.own_context:
+                locks.release('cases', self.instance.id, self.batch)
+                self._publish()
+                self.progress.done(self.result)
 
 
 class SetsRunner(object):
-    def __init__(self, set_id, batch, level='sets', task_id=None, counter=None, category='api'):
+    def __init__(self, set_id, batch, level='sets', task_id=None, counter=None, category='api', cassette=None,
+                 partial=False, relations=None):
         """
         :param set_id: test set id, type(string)
         :param level: the level of test cases, type(string)
         :param task_id: test task id, type(string)
         :param counter: counter, type(dict)
         :param category: must be ui、api, type(string)
+        :param cassette: must be None、record or replay, type(string)
+        :param partial: run of one parameter row, the result of the set is saved by save_set_result, type(bool)
+        :param relations: ids of the cases relations to run besides setup and teardown, all when None, type(list)
         """
         self.batch = batch
         self.set_id = set_id
@@ -356,49 +386,70 @@ class SetsRunner(object):
         self.task_id = task_id
         self.result = 'Succeed'
         self.error = None
-        self.v_key = None
+        self.context = None
         self.counter = counter
         self.category = category
+        self.cassette = cassette
+        self.partial = partial
+        self.relations = relations
         self.start_time = timezone.now()
         self.setInstance = Sets.objects.get(pk=set_id)
+        self.buffer = ResultBuffer(batch)
+        self.progress = Progress(batch)
+        # sets of a task run are cancelled once this many sets of the run failed
+        self.failure_threshold = None
+        # reason the remaining cases are skipped
+        self.stopped = None
+        self.skipped = []
 
         self._get_config()
-        self._get_cases()
+        self.loader = PlanLoader(self.setInstance, self.level, self.task_id, relations)
         self._get_relationship()
 
     def _get_config(self):
-        result = self.setInstance.config
-        if result.exists():
-            self.config = result.first()
-        else:
-            self.config = Config.objects.filter(globalConfig=1, project=self.setInstance.project,
-                                                category=self.category).first()
-
-    def _get_cases(self):
-        self.cases = self.setInstance.relations.filter(tasks_id=self.task_id, level=self.level,
-                                                       handler=None).order_by('order')
-        self.setup_cases = self.setInstance.relations.filter(tasks_id=self.task_id, level=self.level,
-                                                             handler='setup').order_by('order')
-        self.teardown_cases = self.setInstance.relations.filter(tasks_id=self.task_id, level=self.level,
-                                                                handler='teardown').order_by('order')
+        self.config = ConfigCache.get(self.setInstance.project_id, self.category, self.set_id)
 
     def _get_relationship(self):
         if self.level == 'tasks':
-            self.relation = self.setInstance.relationship.get(tasks_id=self.task_id)
+            self.relation = self.setInstance.relationship.select_related('tasks').get(tasks_id=self.task_id)
+            self.failure_threshold = self.relation.tasks.failure_threshold
 
     def _generate_key(self):
         task_uuid = self.task_id or ''
         name = ''.join([self.set_id, self.level, task_uuid, str(time.time())])
         return str(uuid5(uuid.NAMESPACE_OID, name))
 
+    def _cancelled(self):
+        if not self.failure_threshold:
+            return False
+        failures = failure_count(self.batch)
+        if failures >= self.failure_threshold:
+            self.stopped = 'cancelled, {} sets of the task failed'.format(failures)
+            return True
+        return False
+
+    def _should_stop(self, relation, error):
+        """
+        :param relation: finished relation, type(CasesRelationShip)
+        :param error: error message of the case, type(string)
+        :return: True when the remaining cases of the set are not run
+        """
+        if error and not relation.cases.continues:
+            self.stopped = 'stopped after {} failed'.format(relation.cases.name)
+            return True
+        return self._cancelled()
+
     def _setup(self):
+        if self._cancelled():
+            self.result = 'Skipped'
+            self.loader.drain()
+            raise Exception(self.stopped)
+
         case_instance = None
         try:
-            for setup in self.setup_cases:
+            for setup in self.loader.setup():
                 case_instance = setup.cases
-                CasesRunner(case_instance, self.batch, level=self.level, set_instance=self.setInstance,
-                            order=setup.order, config_instance=self.config, handler='setup', key=self.v_key,
-                            counter=self.counter, task_id=self.task_id, category=self.category).run()
+                self._run_setup(setup)
         except Exception as e:
             self.result = "Failed"
             self.error = 'setup: {} failed:{}; {}'.format(case_instance.name, e, self.error)
@@ -406,54 +457,117 @@ class SetsRunner(object):
                                                                              case_instance.name, e))
             raise Exception(self.error)
 
+    def _run_setup(self, setup):
+        def run():
+            CasesRunner(setup.cases, self.batch, level=self.level, set_instance=self.setInstance,
+                        order=setup.order, handler='setup', context=self.context, task_id=self.task_id,
+                        category=self.category, buffer=self.buffer, relation=setup, progress=self.progress).run()
+
+        if not (setup.cases.shareable and self.category == 'api'):
+            run()
+        # sets of the same batch run a shareable setup once and reuse the variables it extracts
+        elif SharedSetup(self.batch, setup.cases, self.context).run(run):
+            self.buffer.record([setup], result='Succeed', response={'shared': True})
+            self.progress.publish('case', case=setup.cases_id, relation=setup.id, set=self.set_id, task=self.task_id,
+                                  status='Done', result='Succeed')
+
     def _teardown(self):
-        for teardown in self.teardown_cases:
+        for teardown in self.loader.teardown():
             case_instance = teardown.cases
             try:
                 CasesRunner(case_instance, self.batch, level=self.level, set_instance=self.setInstance,
-                            order=teardown.order, config_instance=self.config, handler='teardown', key=self.v_key,
-                            counter=self.counter, task_id=self.task_id, category=self.category).run()
+                            order=teardown.order, handler='teardown', context=self.context,
+                            task_id=self.task_id, category=self.category, buffer=self.buffer,
+                            relation=teardown, progress=self.progress).run()
             except Exception as e:
                 logger.error('tasks: {}, sets: {}, teardown: {}, failed: {}'.format(self.task_id, self.set_id,
                                                                                     case_instance.name, e))
                 pass
 
+    def _run_case(self, case):
+        case_instance = case.cases
+        try:
+            CasesRunner(case_instance, self.batch, level=self.level, set_instance=self.setInstance,
+                        order=case.order, context=self.context, task_id=self.task_id, category=self.category,
+                        buffer=self.buffer, relation=case, progress=self.progress).run()
+        except (Exception, ParseResponseErr) as e:
+            logger.error('tasks: {}, sets: {}, case: {}, failed: {}'.format(self.task_id, self.set_id,
+                                                                            case_instance.name, e))
+            return '{} failed:{}'.format(case_instance.name, e)
+
+    def _run_parallel(self, cases):
+        shared_reads = references(self.context.base_url) | references(dict(self.context.headers))
+        graph = DependencyGraph(list(cases), shared_reads=shared_reads)
+        errors = graph.run(self._run_case, self.setInstance.workers, stop=self._should_stop)
+        self.skipped.extend(graph.skipped)
+        return errors
+
+    def _run_sequential(self, cases):
+        errors = []
+        for case in cases:
+            error = self._run_case(case)
+            if error:
+                errors.append(error)
+            if self._should_stop(case, error):
+                break
+        return errors
+
     def _main(self):
-        for case in self.cases:
-            case_instance = case.cases
-            try:
-                CasesRunner(case_instance, self.batch, level=self.level, set_instance=self.setInstance,
-                            order=case.order, config_instance=self.config, key=self.v_key, counter=self.counter,
-                            task_id=self.task_id, category=self.category).run()
-            except Exception as e:
-                self.result = "Failed"
-                self.error = '{} failed:{}; {}'.format(case_instance.name, e, self.error)
-                logger.error('tasks: {}, sets: {}, case: {}, failed: {}'.format(self.task_id, self.set_id,
-                                                                                case_instance.name, e))
+        cases = self.loader.main()
+        if self.setInstance.parallel and self.category == 'api':
+            errors = self._run_parallel(cases)
+        else:
+            errors = self._run_sequential(cases)
+
+        for error in errors:
+            self.result = "Failed"
+            self.error = '{}; {}'.format(error, self.error)
         if self.error:
             raise Exception(self.error)
 
+    def _skip_rest(self):
+        skipped = self.skipped + self.loader.skipped
+        if not skipped:
+            return
+        reason = self.stopped or 'setup failed'
+        if self.result == 'Succeed':
+            # no case failed, the set was cancelled by the failure threshold of its task before all its cases ran
+            self.result = 'Skipped'
+        self.buffer.skip(skipped, reason)
+        self.progress.publish('skip', set=self.set_id, task=self.task_id, relations=[case.id for case in skipped],
+                              reason=reason)
+        self.error = '{}, {} cases skipped; {}'.format(reason, len(skipped), self.error)
+        logger.info("tasks: {}, sets: {}, {}, {} cases skipped".format(self.task_id, self.set_id, reason,
+                                                                        len(skipped)))
+
+    def _flush_results(self):
+        try:
+            self.buffer.flush()
+        except Exception as e:
+            logger.error('tasks: {}, sets: {}, save case results failed: {}'.format(self.task_id, self.set_id, e))
+            self.result = "Failed"
+            self.error = 'save case results failed:{}; {}'.format(e, self.error)
+        logger.info("sets: {}, case results written in {} flush(es)".format(self.set_id, self.buffer.flushes))
+
     def _record_result(self):
-        ret = self.relation.history
-        if ret.count() > 9:
-            ret.earliest('start_time').delete()
         self.relation.history.create(start_time=self.start_time, status='Starting', batch=self.batch)
 
+    def _publish(self, status):
+        self.progress.publish('set', set=self.set_id, task=self.task_id, status=status,
+                              result=None if status == 'Starting' else self.result, counter=self.counter,
+                              partial=self.partial)
+
     def _update_result(self, status, end_time):
         self.relation.history.filter(batch=self.batch).update(status=status, result=self.result,
                                                               error_message=self.error, end_time=end_time)
 
     def run(self):
-        self.v_key = self._generate_key()
-        if self.category == 'api':
-            CasesRunner.class_variables.setdefault(self.v_key, {})
-            CasesRunner.class_variables[self.v_key].setdefault('variables', {})
-        elif self.category == 'ui':
-            Procedures.class_variables.setdefault(self.v_key, {})
-            Procedures.class_variables[self.v_key].setdefault('variables', {})
+        self.context = RunContext(self._generate_key(), self.config, self.counter, self.cassette)
+        heartbeat = Heartbeat(self.batch, self.context).start()
 
-        if self.level == 'tasks':
+        if self.level == 'tasks' and not self.partial:
             self._record_result()
+        self._publish('Starting')
 
         try:
             self._setup()
@@ -467,23 +581,32 @@ class SetsRunner(object):
                 self.error = repr(e)
         finally:
             self._teardown()
-            if self.category == 'api':
-                logger.info("global variables: {}".format(CasesRunner.class_variables))
-                del CasesRunner.class_variables[self.v_key]
-            elif self.category == 'ui':
-                logger.info("global variables: {}".format(Procedures.class_variables))
-
-                # Make sure WebDriver exits
-                driver = Procedures.class_variables[self.v_key]['driver']
-                driver.quit()
-
-                del Procedures.class_variables[self.v_key]
+            self._skip_rest()
+            self._flush_results()
+            logger.info("case plan cache: {}".format(PlanCache.stats()))
+            # make sure WebDriver exits and http sessions are closed
+            self.context.release()
+            heartbeat.stop()
+            if self.level == 'sets' and not self.partial:
+                locks.release('sets', self.set_id, self.batch)
 
             status = "Done"
             end_time = timezone.now()
+            # the failure of a set run once per parameter row is counted by save_set_result
+            if self.level == 'tasks' and self.result == 'Failed' and not self.partial:
+                record_failure(self.batch)
+            if self.partial:
+                self._publish(status)
+                return self.error
+            # reruns and cancelled runs do not tell how long the set takes
+            if self.relations is None and self.result != 'Skipped':
+                record_duration(self.set_id, (end_time - self.start_time).total_seconds())
             if self.level == 'sets':
                 self.setInstance.history.filter(batch=self.batch).update(status=status, result=self.result,
                                                                          error_message=self.error, end_time=end_time)
+                self._publish(status)
+                self.progress.done(self.result)
             elif self.level == 'tasks':
                 self._update_result(status, end_time)
+                self._publish(status)
                 return self.error
@@ -0,0 +1,51 @@
+import heapq
+import logging
+from django.db.models import F, Case, When, Value, FloatField
+from cronus.settings import SET_WORKERS, SET_DURATION_ALPHA
+from services.models import Sets
+
+
+logger = logging.getLogger()
+
+
+def record_duration(set_id, seconds, alpha=SET_DURATION_ALPHA):
+    """
+    Update the exponential moving average of the duration of a set in one statement
+    :param set_id: id of the test set, type(string)
+    :param seconds: duration of the finished run, type(float)
+    :param alpha: weight of the latest run, type(float)
+    """
+    Sets.objects.filter(pk=set_id).update(duration_ema=Case(
+        When(duration_ema__isnull=True, then=Value(seconds)),
+        default=F('duration_ema') * (1 - alpha) + seconds * alpha,
+        output_field=FloatField()
+    ))
+
+
+def predict(sets):
+    """
+    :param sets: instances of test sets, type(list)
+    :return: sets with their predicted seconds, sets never run are predicted with the mean of the others, type(list)
+    """
+    known = [test_set.duration_ema for test_set in sets if test_set.duration_ema is not None]
+    default = sum(known) / len(known) if known else 0.0
+    return [(test_set, default if test_set.duration_ema is None else test_set.duration_ema) for test_set in sets]
+
+
+def schedule(sets, workers=SET_WORKERS):
+    """
+    Longest processing time first: sets are ordered by predicted duration, every set goes to the worker which
+    is free first, the busiest worker gives the makespan
+    :param sets: instances of test sets, type(list)
+    :param workers: number of worker processes running sets, type(int)
+    :return: (set, predicted seconds, worker) in dispatch order and the predicted makespan in seconds, type(tuple)
+    """
+    loads = [(0.0, worker) for worker in range(max(1, workers))]
+    plan = []
+    for test_set, duration in sorted(predict(list(sets)), key=lambda item: item[1], reverse=True):
+        load, worker = heapq.heappop(loads)
+        plan.append((test_set, duration, worker))
+        heapq.heappush(loads, (load + duration, worker))
+    makespan = max(load for load, _ in loads)
+    logger.info("scheduled {} sets on {} workers, makespan: {:.1f}s".format(len(plan), len(loads), makespan))
+    return plan, makespan
@@ -11,8 +11,10 @@ from django_celery_beat.models import PeriodicTasks
 
 from services.utils import generate_uuid
 from services.tasks import bound_set_to_task, bound_cases_to_set, Start, run
+from services.parameters import parse_csv, validate_rows
+from services.rerun import failed
 from services.models import Projects, Config, Counter, Cases, Tasks, Sets, Histories, CasesRelationShip, \
-    SetsRelationShip, CrontabSchedule, PeriodicTask
+    SetsRelationShip, CrontabSchedule, PeriodicTask, LoadSummary, PeriodicTrigger
 
 
 logger = logging.getLogger()
@@ -173,6 +175,28 @@ class SetsSerializer(serializers.ModelSerializer):
     def validate_name(self, name):
         return _validate_name(name)
 
+    def validate_parameters(self, parameters):
+        try:
+            return validate_rows(parameters)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class ParameterSerializer(serializers.Serializer):
+    file = serializers.FileField(write_only=True)
+    parameters = serializers.ListField(read_only=True)
+
+    def validate_file(self, file):
+        try:
+            return parse_csv(file.read())
+        except (ValueError, UnicodeDecodeError) as e:
+            raise serializers.ValidationError('invalid csv file: {}'.format(e))
+
+    def update(self, instance, validated_data):
+        instance.parameters = validated_data.get('file')
+        instance.save(update_fields=['parameters', 'updateTime'])
+        return instance
+
 
 class TasksSerializer(serializers.ModelSerializer):
     id = serializers.CharField(read_only=True)
@@ -314,6 +338,34 @@ class RunnerSerializer(serializers.Serializer):
     level = serializers.CharField()
     category = serializers.CharField()
     tags = serializers.CharField(required=False, allow_blank=True)
+    target = serializers.ChoiceField(choices=('cases', 'sets'), required=False)
+    concurrency = serializers.IntegerField(required=False, min_value=1, default=1)
+    rate = serializers.FloatField(required=False, allow_null=True, min_value=0)
+    duration = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    iterations = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    cassette = serializers.ChoiceField(choices=('record', 'replay'), required=False, allow_null=True)
+    mode = serializers.ChoiceField(choices=('all', 'rerun_failed'), required=False, default='all')
+    batch = serializers.UUIDField(required=False, allow_null=True)
+
+    def validate(self, attrs):
+        if attrs.get('mode') == 'rerun_failed':
+            if attrs.get('level') not in ('sets', 'tasks'):
+                raise serializers.ValidationError('rerun_failed only supports sets and tasks level')
+            if not attrs.get('batch'):
+                raise serializers.ValidationError('rerun_failed needs the batch to rerun')
+            attrs['failed'] = failed(attrs.get('level'), attrs.get('id'), attrs.get('batch'))
+            if not attrs['failed']:
+                raise serializers.ValidationError('nothing failed in batch: {}'.format(attrs.get('batch')))
+        if attrs.get('cassette') and attrs.get('category') != 'api':
+            raise serializers.ValidationError('record and replay only support api category')
+        if attrs.get('level') == 'load':
+            if not attrs.get('target'):
+                raise serializers.ValidationError("the target of load run should be 'cases' or 'sets'")
+            if attrs.get('category') != 'api':
+                raise serializers.ValidationError('load run only supports api category')
+            if not attrs.get('duration') and not attrs.get('iterations'):
+                raise serializers.ValidationError('load run needs duration or iterations')
+        return attrs
 
     def create(self, validated_data):
         logger.info("Request data for executing tasks: {}".format(validated_data))
@@ -321,14 +373,37 @@ class RunnerSerializer(serializers.Serializer):
         level = validated_data.get('level')
         tags = validated_data.get('tags', None)
         category = validated_data.get('category', None)
+        target = validated_data.get('target', None)
+        cassette = validated_data.get('cassette', None)
+        parent_batch = validated_data.get('batch', None)
+        failed_ids = validated_data.get('failed', None)
 
-        assert level in ('cases', 'sets', 'tasks'), "level not in ('cases', 'sets', 'tasks')"
+        assert level in ('cases', 'sets', 'tasks', 'load'), "level not in ('cases', 'sets', 'tasks', 'load')"
         batch = generate_uuid()
-        Start(obj_id, level, batch).run()
+        Start(obj_id, level, batch, target=target, parent_batch=failed_ids and parent_batch).run()
+
+        options = None
+        if level == 'load':
+            options = {
+                'target': target,
+                'concurrency': validated_data.get('concurrency'),
+                'rate': validated_data.get('rate'),
+                'duration': validated_data.get('duration'),
+                'iterations': validated_data.get('iterations'),
+                'cassette': cassette
+            }
+        run(level, obj_id, batch, tags, category, options, cassette, failed_ids)
+
+        if level == 'load':
+            # the response of a load run has its batch, clients follow its progress and find its summary with it
+            validated_data['batch'] = batch
+        return validated_data
 
-        run(level, obj_id, batch, tags, category)
 
-        return validated_data
+class LoadSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LoadSummary
+        fields = '__all__'
 
 
 class CaseRelationShipSerializer(serializers.ModelSerializer):
@@ -395,20 +470,30 @@ class PeriodicTaskSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def create(self, validated_data):
-        return PeriodicTask.objects.create(
+        instance = PeriodicTask.objects.create(
             crontab=validated_data.get('crontab'),
             name=validated_data.get('name'),
             task=validated_data.get('task'),
             args=json.dumps([str(validated_data.get('tasks').id)]),
-            kwargs=json.dumps({'tags': validated_data.get('tags'), 'category': validated_data.get('category')}),
             tags=validated_data.get('tags'),
             category=validated_data.get('category'),
             tasks=validated_data.get('tasks'),
             display=validated_data.get('display'),
-            project=validated_data.get('project')
+            project=validated_data.get('project'),
+            overlap=validated_data.get('overlap', 'skip')
         )
+        # the run tells its periodic task by the id, which is known once the periodic task is created
+        instance.kwargs = json.dumps({'tags': instance.tags, 'category': instance.category, 'periodic': instance.id})
+        instance.save(update_fields=['kwargs'])
+        return instance
 
     def update(self, instance, validated_data):
         super(PeriodicTaskSerializer, self).update(instance, validated_data)
         PeriodicTasks.changed(instance)
         return instance
+
+
+class PeriodicTriggerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PeriodicTrigger
+        fields = '__all__'
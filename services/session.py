@@ -0,0 +1,64 @@
+import logging
+import threading
+from requests import Session
+from cronus.settings import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE
+from services.timing import TimedAdapter
+from services.cassette import RecordAdapter, ReplayAdapter
+
+
+logger = logging.getLogger()
+
+
+class SessionPool(object):
+    """
+    keep-alive sessions of one run, cases sharing the pool share connections and cookies
+    """
+
+    def __init__(self, cassette=None):
+        """
+        :param cassette: record responses, or replay recorded responses without the network, type(string)
+        """
+        self.sessions = {}
+        self.cassette = cassette
+        self.lock = threading.Lock()
+
+    def _adapter(self):
+        if self.cassette == 'replay':
+            return ReplayAdapter()
+        adapter_class = RecordAdapter if self.cassette == 'record' else TimedAdapter
+        return adapter_class(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+
+    def _create(self, verify):
+        """
+        every adapter caches HTTP_POOL_CONNECTIONS host pools, each host pool keeps at most HTTP_POOL_MAXSIZE
+        connections
+        """
+        session = Session()
+        adapter = self._adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.verify = verify
+        return session
+
+    def get(self, proxies=None, verify=False):
+        """
+        :param proxies: requests proxies, connections through different proxies are not shared. The proxies must
+                        still be passed to every request, with trust_env the HTTP(S)_PROXY variables of the environment
+                        override the proxies of a session, type(dict)
+        :param verify: verify the server's TLS certificate, type(bool)
+        :return: object of requests.Session
+        """
+        name = tuple(sorted((proxies or {}).items())), verify
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is None:
+                session = self.sessions[name] = self._create(verify)
+        return session
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+        return len(sessions)
@@ -0,0 +1,121 @@
+import json
+import time
+import uuid
+import hashlib
+import logging
+from redis import RedisError
+from cronus.settings import SHARED_SETUP_TTL, SHARED_SETUP_WAIT
+from services.dependency import references
+from services.utils import get_redis
+
+
+logger = logging.getLogger()
+
+# seconds between two looks at a setup run by another set
+POLL_INTERVAL = 0.2
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def setup_key(batch, case, context):
+    """
+    :param batch: batch of the run, type(string)
+    :param case: instance of test case, type(object)
+    :param context: context of the set run, type(RunContext)
+    :return: redis key of the case in the batch, for the config and the variables the case reads, type(string)
+    """
+    names = references(case.url) | references(case.headers) | references(case.body)
+    names -= set((case.variables or {}).keys())
+    seen = {
+        'base_url': context.base_url,
+        'headers': dict(context.headers),
+        'proxy': context.proxy,
+        'variables': {name: context.variables.get(name) for name in sorted(names)}
+    }
+    digest = hashlib.sha1(json.dumps(seen, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return 'cronus:setup:{}:{}:{}'.format(batch, case.id, digest)
+
+
+class SharedSetup(object):
+    """
+    Setup case run once per batch, case and config. The variables it extracts are cached in redis for
+    SHARED_SETUP_TTL seconds, sets asking for a setup being run by another set wait for it instead of running
+    it again. Without redis every set runs the setup itself.
+    """
+
+    def __init__(self, batch, case, context, ttl=SHARED_SETUP_TTL, wait=SHARED_SETUP_WAIT):
+        """
+        :param batch: batch of the run, type(string)
+        :param case: instance of test case, type(object)
+        :param context: context of the set run, extracted variables are written to its run variables
+        :param ttl: seconds the extracted variables are kept, type(int)
+        :param wait: max seconds to wait for the setup run by another set, type(int)
+        """
+        self.key = setup_key(batch, case, context)
+        self.lock_key = '{}:lock'.format(self.key)
+        self.token = uuid.uuid4().hex
+        self.context = context
+        self.names = [extract.get('name') for extract in case.extracts or [] if extract.get('name')]
+        self.ttl = ttl
+        self.wait = wait
+
+    def _cached(self, client):
+        values = client.get(self.key)
+        if values is None:
+            return False
+        self.context.run_variables.update(json.loads(values))
+        return True
+
+    def _acquire(self, client):
+        """
+        :return: True when the cached variables are used, False when the lock is held
+        """
+        deadline = time.monotonic() + self.wait
+        while not self._cached(client):
+            if client.set(self.lock_key, self.token, nx=True, ex=self.wait):
+                return False
+            if time.monotonic() > deadline:
+                logger.warning("wait for shared setup {} timed out".format(self.key))
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def _store(self, client):
+        values = {name: self.context.variables[name] for name in self.names if name in self.context.variables}
+        try:
+            client.set(self.key, json.dumps(values, default=str), ex=self.ttl)
+        except RedisError as e:
+            logger.warning("cache shared setup {} failed: {}".format(self.key, e))
+
+    def _release(self, client):
+        try:
+            client.eval(RELEASE_SCRIPT, 1, self.lock_key, self.token)
+        except RedisError as e:
+            logger.warning("release shared setup {} failed: {}".format(self.key, e))
+
+    def run(self, func):
+        """
+        :param func: callable running the case, raises when the case fails
+        :return: True when the variables extracted by another set were used, type(bool)
+        """
+        client = get_redis()
+        try:
+            if client is not None and self._acquire(client):
+                logger.info("shared setup {} reused".format(self.key))
+                return True
+        except RedisError as e:
+            logger.warning("shared setup {} unavailable: {}".format(self.key, e))
+            client = None
+
+        try:
+            func()
+            if client is not None:
+                self._store(client)
+        finally:
+            if client is not None:
+                self._release(client)
+        return False
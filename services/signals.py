@@ -0,0 +1,34 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from services.models import Cases, Config, Histories
+from services.compiler import PlanCache
+from services.configs import ConfigCache
+from services.storage import remove_response
+
+
+@receiver(post_save, sender=Cases)
+@receiver(post_delete, sender=Cases)
+def invalidate_case_plan(sender, instance, **kwargs):
+    """
+    Drop the compiled plan of a case in this process, other workers notice the new updateTime
+    """
+    PlanCache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=Config)
+@receiver(post_delete, sender=Config)
+@receiver(m2m_changed, sender=Config.sets.through)
+def invalidate_configs(sender, **kwargs):
+    """
+    Drop the resolved configs of every worker
+    """
+    if kwargs.get('action', 'post_').startswith('post_'):
+        ConfigCache.invalidate()
+
+
+@receiver(post_delete, sender=Histories)
+def remove_history_response(sender, instance, **kwargs):
+    """
+    Histories are deleted with their case, set, task or project, their response files follow every cascade
+    """
+    remove_response(instance)
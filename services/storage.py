@@ -0,0 +1,95 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+from django.db import transaction
+from cronus.settings import MEDIA_ROOT, PRIVATE_ROOT, RESPONSE_INLINE_LIMIT, RESPONSE_PREVIEW_SIZE, \
+    RESPONSE_STORE_DIR
+from services.models import Histories
+from services.utils import remove_file
+
+
+logger = logging.getLogger()
+
+
+def _blob(response):
+    if isinstance(response, dict) and isinstance(response.get('blob'), dict):
+        return response['blob']
+
+
+def store_response(response):
+    """
+    Responses larger than RESPONSE_INLINE_LIMIT are written gzip compressed to a file named by their hash,
+    the history only keeps a reference and a preview. The files are under PRIVATE_ROOT, which is not served,
+    the full response is only returned by ResponseViewSet
+    :param response: status code, headers and text of the response, type(dict)
+    :return: value of Histories.response, type(dict)
+    """
+    content = json.dumps(response, ensure_ascii=False)
+    data = content.encode('utf-8')
+    if len(data) <= RESPONSE_INLINE_LIMIT:
+        return response
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = '{}/{}/{}.json.gz'.format(RESPONSE_STORE_DIR, digest[:2], digest)
+    full_path = os.path.join(PRIVATE_ROOT, path)
+    if not os.path.exists(full_path):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(full_path, os.getpid())
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+    logger.info("response of {} bytes stored in {}".format(len(data), path))
+
+    ret = {
+        'status_code': response.get('status_code'),
+        'blob': {'path': path, 'hash': digest, 'size': len(data)},
+        'preview': content[:RESPONSE_PREVIEW_SIZE]
+    }
+    if response.get('error'):
+        ret['error'] = response['error']
+    return ret
+
+
+def load_response(response):
+    """
+    :param response: value of Histories.response, type(dict)
+    :return: the full response, read from its file when it is not stored inline, type(dict)
+    """
+    blob = _blob(response)
+    if not blob:
+        return response
+    full_path = os.path.join(PRIVATE_ROOT, blob['path'])
+    try:
+        with gzip.open(full_path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except FileNotFoundError:
+        logger.error("response file not found: {}".format(full_path))
+        return dict(response, error='response file not found')
+
+
+def _remove_blob(blob, ids):
+    if not Histories.objects.filter(response__blob__hash=blob['hash']).exclude(id__in=ids).exists():
+        remove_file(os.path.join(PRIVATE_ROOT, blob['path']))
+
+
+def remove_response(history):
+    """
+    Remove the response file of a deleted history once the deletion is committed, unless other histories still
+    reference the same content
+    :param history: deleted instance of Histories, type(object)
+    """
+    blob = _blob(history.response)
+    if blob:
+        transaction.on_commit(lambda: _remove_blob(blob, []))
+
+
+def remove_histories(queryset):
+    """
+    Delete histories together with their screenshots, response files are removed by the post_delete signal
+    :param queryset: histories to delete, type(QuerySet)
+    """
+    for image in queryset.exclude(image__isnull=True).exclude(image='').values_list('image', flat=True):
+        remove_file(os.path.join(MEDIA_ROOT, image))
+    queryset.delete()
@@ -0,0 +1,197 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from urllib.parse import parse_qs
+import redis
+from asgiref.sync import sync_to_async
+from redis import RedisError
+from django.db import close_old_connections
+from oauth2_provider.models import AccessToken
+from cronus.settings import PROGRESS_KEEPALIVE, PROGRESS_PATH, REDIS_URL
+from services.models import Histories, LoadSummary
+from services.buffer import live_status
+from services.progress import PROGRESS_PREFIX
+
+
+logger = logging.getLogger()
+
+
+class ProgressHub(object):
+    """
+    One redis subscription per process for the progress of every run, messages are handed to the streams of
+    their batch. Streams only wait on their queues, no thread or redis connection is held per client.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def subscribe(self, batch):
+        """
+        :param batch: batch of the run, type(string)
+        :return: queue receiving the messages published for the batch, type(asyncio.Queue)
+        """
+        queue = asyncio.Queue()
+        with self.lock:
+            self.queues.setdefault(batch, set()).add(queue)
+            if self.thread is None:
+                self.loop = asyncio.get_event_loop()
+                self.thread = threading.Thread(target=self._listen, name='progress-hub', daemon=True)
+                self.thread.start()
+        return queue
+
+    def unsubscribe(self, batch, queue):
+        with self.lock:
+            queues = self.queues.get(batch, set())
+            queues.discard(queue)
+            if not queues:
+                self.queues.pop(batch, None)
+
+    def _dispatch(self, message):
+        batch = message['channel'][len(PROGRESS_PREFIX):]
+        with self.lock:
+            queues = list(self.queues.get(batch, ()))
+        for queue in queues:
+            self.loop.call_soon_threadsafe(queue.put_nowait, message['data'])
+
+    def _listen(self):
+        # the shared client times out reads after 2s, the subscription waits for messages as long as it takes
+        try:
+            client = redis.Redis.from_url(REDIS_URL, socket_timeout=None, socket_connect_timeout=2,
+                                          socket_keepalive=True, decode_responses=True)
+        except ValueError as e:
+            logger.error("progress streams only send keepalives without redis: {}".format(e))
+            return
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe('{}*'.format(PROGRESS_PREFIX))
+                for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._dispatch(message)
+            except RedisError as e:
+                logger.warning("progress subscription failed, retry in 1s: {}".format(e))
+                time.sleep(1)
+
+
+hub = ProgressHub()
+
+
+def _authenticate(token):
+    """
+    :return: the access token is valid and its user is active, type(bool)
+    """
+    close_old_connections()
+    try:
+        access_token = AccessToken.objects.select_related('user').filter(token=token).first()
+        return bool(access_token and access_token.is_valid() and access_token.user.is_active)
+    finally:
+        close_old_connections()
+
+
+def _running(batch):
+    """
+    :return: the batch has records which are not done, type(bool)
+    """
+    close_old_connections()
+    try:
+        return Histories.objects.filter(batch=batch, status='Starting').exists() or LoadSummary.objects.filter(
+            batch=batch, status='Starting').exists()
+    finally:
+        close_old_connections()
+
+
+def _token(scope):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('access_token'):
+        return query['access_token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization' and value.lower().startswith(b'bearer '):
+            return value[7:].decode('latin-1')
+
+
+async def _respond(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode('utf-8')})
+
+
+async def _disconnected(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def _event(data):
+    return 'data: {}\n\n'.format(data).encode('utf-8')
+
+
+async def stream(scope, receive, send, batch):
+    """
+    Server-sent events of the progress of a run: a snapshot of the running cases first, then every state
+    change published by the runners, a comment every PROGRESS_KEEPALIVE seconds keeps the connection open.
+    The stream ends after the done event of the run, or at once when the run is not running.
+    """
+    token = _token(scope)
+    if not token or not await sync_to_async(_authenticate)(token):
+        await _respond(send, 401, {'detail': 'Authentication credentials were not provided.'})
+        return
+
+    # subscribe before the check, so the end of a run finishing meanwhile is not missed
+    queue = hub.subscribe(batch)
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')
+        ]})
+        snapshot = {'event': 'snapshot', 'batch': batch, 'cases': await sync_to_async(live_status)(batch)}
+        await send({'type': 'http.response.body', 'body': _event(json.dumps(snapshot)), 'more_body': True})
+        if not await sync_to_async(_running)(batch):
+            await send({'type': 'http.response.body', 'body': _event(json.dumps({'event': 'done', 'batch': batch}))})
+            return
+
+        while True:
+            received = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait([received, disconnected], timeout=PROGRESS_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                received.cancel()
+                return
+            if received not in done:
+                received.cancel()
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            data = received.result()
+            finished = json.loads(data).get('event') == 'done'
+            await send({'type': 'http.response.body', 'body': _event(data), 'more_body': not finished})
+            if finished:
+                return
+    finally:
+        disconnected.cancel()
+        hub.unsubscribe(batch, queue)
+
+
+class ProgressStream(object):
+    """
+    ASGI application serving the progress streams under PROGRESS_PATH, other requests go to django
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get('path', '')
+        if scope['type'] != 'http' or not path.startswith(PROGRESS_PATH):
+            return await self.application(scope, receive, send)
+        try:
+            # batches are published as hex strings
+            batch = uuid.UUID(path[len(PROGRESS_PATH):].strip('/')).hex
+        except ValueError:
+            return await _respond(send, 404, {'detail': 'Not found.'})
+        await stream(scope, receive, send, batch)
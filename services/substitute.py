@@ -2,10 +2,46 @@ import string
 import json
 
 
+class CompiledTemplate(object):
+    def __init__(self, template):
+        """
+        string.Template split once into literal and variable parts, substitute behaves like safe_substitute
+        :param template: string
+        """
+        self.template = template
+        self.parts = []
+        literal = ''
+        position = 0
+        for match in string.Template.pattern.finditer(template):
+            start, end = match.span()
+            literal += template[position:start]
+            name = match.group('named') or match.group('braced')
+            if name:
+                self.parts.append((literal, None))
+                self.parts.append((match.group(), name))
+                literal = ''
+            elif match.group('escaped') is not None:
+                literal += '$'
+            else:
+                literal += match.group()
+            position = end
+        self.parts.append((literal + template[position:], None))
+
+    def substitute(self, variable=None):
+        variable = variable or {}
+        contents = []
+        for text, name in self.parts:
+            if name is not None and name in variable:
+                contents.append(str(variable[name]))
+            else:
+                contents.append(text)
+        return ''.join(contents)
+
+
 class Parser(object):
     def __init__(self, target, variable=None):
         """
-        :param target: json format
+        :param target: json format, or CompiledTemplate
         :param variable: dict
         """
         self.target = target
@@ -16,7 +52,21 @@ class Parser(object):
         Replace variables in strings
         :return string
         """
+        if isinstance(self.target, CompiledTemplate):
+            return self.target.substitute(self.variable)
         if isinstance(self.target, (list, dict)):
             self.target = json.dumps(self.target)
         template = string.Template(self.target)
         return template.safe_substitute(self.variable)
+
+    @staticmethod
+    def compile(target):
+        """
+        :param target: json format
+        :return: object of CompiledTemplate, None when target is None
+        """
+        if target is None:
+            return None
+        if isinstance(target, (list, dict)):
+            target = json.dumps(target)
+        return CompiledTemplate(target)
@@ -1,15 +1,27 @@
 from __future__ import absolute_import, unicode_literals
 
-import os
+import math
 from itertools import cycle
-from rest_framework import serializers
+from django.db import transaction
 from django.utils import timezone
 from celery import shared_task, chord
 from celery.utils.log import get_task_logger
-from cronus.settings import MEDIA_ROOT
-from services.utils import remove_file, generate_uuid
-from services.models import Tasks, Cases, Sets, Histories
+from cronus.settings import INTERACTIVE_QUEUE, SCHEDULED_QUEUE, INTERACTIVE_PRIORITY, SCHEDULED_PRIORITY, \
+    TASK_CHUNK_SIZE, REAPER_REQUEUE
+from services.utils import generate_uuid
+from services.models import Tasks, Cases, Sets, Histories, PeriodicTask
 from services.runner import CasesRunner, SetsRunner
+from services.load import LoadRunner
+from services.retention import prune_histories as prune
+from services.reaper import reap
+from services.parameters import expand_rows
+from services.failures import record_failure
+from services.scheduler import record_duration, schedule
+from services.exceptions import Conflict
+from services.heartbeat import touch
+from services.progress import Progress
+from services.periodic import OVERLAP_CONCURRENT, OVERLAP_QUEUE, mark_pending, pop_pending, record_trigger
+from services import locks
 
 logger = get_task_logger(__name__)
 
@@ -42,56 +54,246 @@ def bound_cases_to_set(set_id, handler, cases):
 
 class Start(object):
 
-    def __init__(self, obj_id, level, batch):
+    def __init__(self, obj_id, level, batch, target=None, parent_batch=None):
+        """
+        :param obj_id: id of the case, set or task, type(string)
+        :param level: must be cases、sets、tasks or load, type(string)
+        :param batch: id of this run, type(string)
+        :param target: level of the load run object, must be cases or sets, type(string)
+        :param parent_batch: batch rerun by this run, type(string)
+        """
         self.id = obj_id
         self.batch = batch
         self.level = level
+        self.target = target
+        self.parent_batch = parent_batch
         self.start_time = timezone.now()
 
     @staticmethod
-    def _remove_file(instance):
-        image = instance.image
-        if image:
-            file_path = os.path.join(MEDIA_ROOT, str(image))
-            remove_file(file_path)
-
-    def _set_status(self, instance, start_time=None, status=None, batch=None):
-        ret = instance.history
-        if ret.count() > 9:
-            obj = ret.earliest('start_time')
-            self._remove_file(obj)
-            obj.delete()
-        instance.history.create(start_time=start_time, status=status, batch=batch)
-
-    def run(self):
+    def _set_status(instance, start_time=None, status=None, batch=None, parent_batch=None):
+        instance.history.create(start_time=start_time, status=status, batch=batch, parent_batch=parent_batch)
+
+    @staticmethod
+    def _set_load_status(instance, start_time=None, status=None, batch=None):
+        instance.load.create(start_time=start_time, status=status, batch=batch)
+
+    def _model(self):
         if self.level == 'cases':
-            instance = Cases.objects.get(id=self.id)
-            ret = instance.history.filter(status='Starting').exists()
+            return Cases
         elif self.level == 'sets':
-            instance = Sets.objects.get(id=self.id)
-            ret = instance.history.filter(status='Starting').exists()
-        else:
-            instance = Tasks.objects.get(id=self.id)
-            ret = instance.history.filter(status='Starting').exists()
+            return Sets
+        elif self.level == 'load':
+            return Cases if self.target == 'cases' else Sets
+        return Tasks
+
+    def _admit(self, check):
+        """
+        :param check: refuse the run while the object has a running history, type(bool)
+        """
+        queryset = self._model().objects
+        with transaction.atomic():
+            if not check:
+                instance = queryset.get(id=self.id)
+            else:
+                # without redis the row of the object serializes concurrent starts
+                instance = queryset.select_for_update().get(id=self.id)
+                history = instance.load if self.level == 'load' else instance.history
+                if history.filter(status='Starting').exists():
+                    raise Conflict('task: %s already running' % self.id)
+
+            if self.level == 'load':
+                self._set_load_status(instance, start_time=self.start_time, status='Starting', batch=self.batch)
+            else:
+                self._set_status(instance, start_time=self.start_time, status='Starting', batch=self.batch,
+                                 parent_batch=self.parent_batch)
+
+    def run(self, exclusive=True):
+        """
+        Admit the run once per object, the lock is released by the run when it is done
+        :param exclusive: refuse the run while another run of the object is going, type(bool)
+        """
+        if not exclusive:
+            self._admit(check=False)
+            return
+        locked = locks.acquire(self.level, self.id, self.batch)
+        if locked is False:
+            raise Conflict('task: %s already running' % self.id)
+        try:
+            self._admit(check=not locked)
+        except Exception:
+            if locked:
+                locks.release(self.level, self.id, self.batch)
+            raise
+
+
+def queue_options(interactive=True, category='api'):
+    """
+    :param interactive: run started by a user, or by a periodic task, type(bool)
+    :param category: ui runs go to the workers with a browser, type(string)
+    :return: options sending a run to its queue with its priority, type(dict)
+    """
+    category = 'ui' if category == 'ui' else 'api'
+    if interactive:
+        return {'queue': '{}.{}'.format(category, INTERACTIVE_QUEUE), 'priority': INTERACTIVE_PRIORITY}
+    return {'queue': '{}.{}'.format(category, SCHEDULED_QUEUE), 'priority': SCHEDULED_PRIORITY}
+
+
+def record_queue_wait(batch, **lookups):
+    """
+    Seconds a run waited in its queue, its history is created by Start right before the run is sent
+    """
+    now = timezone.now()
+    histories = Histories.objects.filter(batch=batch, queue_wait__isnull=True, **lookups)
+    for history_id, start_time in histories.values_list('id', 'start_time'):
+        if start_time:
+            Histories.objects.filter(id=history_id).update(queue_wait=(now - start_time).total_seconds())
 
-        if ret:
-            raise serializers.ValidationError('task: %s already running' % self.id)
 
-        self._set_status(instance, start_time=self.start_time, status='Starting', batch=self.batch)
+@shared_task
+def run_case(case_id, batch, category, cassette=None):
+    record_queue_wait(batch, cases_id=case_id)
+    instance = Cases.objects.get(pk=case_id)
+    CasesRunner(instance, batch, category=category, cassette=cassette).run()
 
 
 @shared_task
-def run_case(case_id, batch, category):
-    instance = Cases.objects.get(pk=case_id)
-    CasesRunner(instance, batch, category=category).run()
+def run_set(set_id, batch, category=None, level='sets', task_id=None, counter=None, cassette=None, partial=False,
+            relations=None):
+    logger.info("run test set, test set: {}, batch: {}, level: {}, task id: {}, counter: {}, cassette: {}".format(
+        set_id, batch, level, task_id, counter, cassette))
+    if level == 'sets':
+        record_queue_wait(batch, sets_id=set_id)
+    return SetsRunner(set_id, batch, level=level, task_id=task_id, counter=counter, category=category,
+                      cassette=cassette, partial=partial, relations=relations).run()
+
+
+@shared_task
+def save_set_result(results, set_id, batch, level='sets', task_id=None):
+    """
+    Save the result of a set run once per parameter row
+    :param results: errors of the rows grouped by chunk, type(list)
+    """
+    errors = []
+    index = 0
+    for chunk in results:
+        for error in chunk or []:
+            if error:
+                errors.append('row {}: {}'.format(index, error))
+            index += 1
+
+    error_msg = '; '.join(errors) or None
+    result = errors and 'Failed' or 'Succeed'
+    logger.info("test set: {}, batch: {}, rows: {}, failed: {}".format(set_id, batch, index, len(errors)))
+
+    queryset = Histories.objects.filter(batch=batch)
+    if level == 'tasks':
+        queryset = queryset.filter(task_sets__tasks_id=task_id, task_sets__sets_id=set_id)
+        if errors:
+            record_failure(batch)
+    else:
+        queryset = queryset.filter(sets_id=set_id)
+        locks.release('sets', set_id, batch)
+    end_time = timezone.now()
+    start_time = queryset.values_list('start_time', flat=True).first()
+    queryset.update(status='Done', result=result, error_message=error_msg, end_time=end_time)
+    if start_time:
+        record_duration(set_id, (end_time - start_time).total_seconds())
+    progress = Progress(batch)
+    progress.publish('set', set=set_id, task=task_id, status='Done', result=result, rows=index)
+    if level != 'tasks':
+        progress.done(result)
+    return error_msg
+
+
+def set_header(set_id, batch, category, level='sets', task_id=None, counter=None, cassette=None, relations=None,
+               interactive=True):
+    """
+    :param relations: ids of the cases relations to run besides setup and teardown, all when None, type(list)
+    :param interactive: run started by a user, or by a periodic task, type(bool)
+    :return: signatures running the set once, or once per parameter row in at most parameter_concurrency chunks,
+             and whether the set runs per parameter row, type(tuple)
+    """
+    set_id = str(set_id)
+    routing = queue_options(interactive, category)
+    set_instance = Sets.objects.select_related('parameter_counter').get(pk=set_id)
+    rows = expand_rows(set_instance, counter)
+    if not rows:
+        return [run_set.s(set_id, batch, category, level, task_id, counter, cassette, False, relations).set(
+            **routing)], False
+
+    if level == 'tasks':
+        relation = set_instance.relationship.get(tasks_id=task_id)
+        relation.history.create(start_time=timezone.now(), status='Starting', batch=batch)
+    size = math.ceil(len(rows) / max(1, set_instance.parameter_concurrency))
+    chunks = run_set.chunks([(set_id, batch, category, level, task_id, row, cassette, True, relations)
+                             for row in rows], size)
+    logger.info("test set: {}, batch: {}, rows: {}, chunk size: {}".format(set_id, batch, len(rows), size))
+    # the tasks of a group are a generator which can only be iterated once
+    return [signature.set(**routing) for signature in chunks.group().tasks], True
+
+
+def set_signature(set_id, batch, category, level='sets', task_id=None, counter=None, cassette=None, relations=None,
+                  interactive=True):
+    """
+    :return: signature running the set, see set_header, the result of a run per parameter row is saved by
+             save_set_result
+    """
+    header, parameterized = set_header(set_id, batch, category, level, task_id, counter, cassette, relations,
+                                       interactive)
+    if not parameterized:
+        return header[0]
+    # saving the result is light, it does not wait for a browser worker
+    return chord(header, save_set_result.s(str(set_id), batch, level, task_id).set(**queue_options(interactive)))
+
+
+@shared_task
+def run_load(obj_id, batch, options):
+    logger.info("load run, object: {}, batch: {}, options: {}".format(obj_id, batch, options))
+    LoadRunner(obj_id, batch, **options).run()
 
 
 @shared_task
-def run_set(set_id, batch, category=None, level='sets', task_id=None, counter=None):
-    logger.info("run test set, test set: {}, batch: {}, level: {}, task id: {}, counter: {}".format(set_id, batch,
-                                                                                                    level, task_id,
-                                                                                                    counter))
-    return SetsRunner(set_id, batch, level=level, task_id=task_id, counter=counter, category=category).run()
+def prune_histories():
+    deleted = prune()
+    logger.info("pruned {} records".format(deleted))
+
+
+def requeue(level, obj_id, batch):
+    """
+    Run an aborted run again as a scheduled run, a rerun which is aborted again is not requeued
+    :param batch: batch of the aborted run, type(string)
+    """
+    models = {'cases': Cases, 'sets': Sets, 'tasks': Tasks}
+    parent_batch = Histories.objects.filter(batch=batch, **{level + '_id': obj_id}).values_list(
+        'parent_batch', flat=True).first()
+    if parent_batch and Histories.objects.filter(batch=parent_batch, result='Aborted').exists():
+        logger.warning("{} {} aborted again, batch: {}, not requeued".format(level, obj_id, batch))
+        return
+    category = models[level].objects.filter(pk=obj_id).values_list('category', flat=True).first()
+    new_batch = generate_uuid()
+    try:
+        Start(obj_id, level, new_batch, parent_batch=batch).run()
+    except Conflict as e:
+        logger.warning("requeue {} {} failed: {}".format(level, obj_id, e.detail))
+        return
+    # the tags of the aborted run are not kept, a requeued task runs all its sets
+    run(level, obj_id, new_batch, tags='all' if level == 'tasks' else None, category=category, interactive=False)
+    logger.info("requeued {} {}, aborted batch: {}, batch: {}".format(level, obj_id, batch, new_batch))
+
+
+@shared_task
+def reap_runs():
+    """
+    Abort the runs whose workers stopped beating, see services.reaper
+    """
+    aborted = reap()
+    logger.info("reaped {} runs".format(len(aborted)))
+    for batch, level, obj_id in aborted:
+        # load runs are not repeated without the user
+        if REAPER_REQUEUE and level != 'load':
+            requeue(level, obj_id, batch)
+        if level == 'tasks':
+            resume_periodic(obj_id)
 
 
 @shared_task
@@ -112,53 +314,186 @@ def save_task_result(info, task_id, batch):
     end_time = timezone.now()
     Histories.objects.filter(tasks_id=task_id, batch=batch).update(status=status, result=result,
                                                                    error_message=error_msg, end_time=end_time)
-
-
-@shared_task
-def run_task(task_id, batch, tags, category):
+    locks.release('tasks', task_id, batch)
+    progress = Progress(batch)
+    progress.publish('task', task=task_id, status=status, result=result)
+    progress.done(result)
+    resume_periodic(task_id)
+
+
+def select_sets(task_id, tags, sets=None):
+    """
+    :param tags: tags of the sets to run, all sets when it is 'all', type(string)
+    :param sets: ids of the sets to run, tags are ignored when given, type(list)
+    :return: sets of the task to run, type(QuerySet)
+    """
     queryset = Sets.objects.filter(tasks__id=task_id)
-    if not tags:
-        test_sets = queryset.filter(tags__contains=[])
+    if sets is not None:
+        return queryset.filter(id__in=sets)
+    elif not tags:
+        return queryset.filter(tags__contains=[])
     elif tags == 'all':
-        test_sets = queryset
+        return queryset
+    return queryset.filter(tags__contains=tags)
+
+
+def send_sets(task_id, batch, category, pending, errors=None, cassette=None, interactive=True):
+    """
+    Send the next TASK_CHUNK_SIZE sets of a task in one chord, the callback of the chord sends the chunk after it,
+    so the broker and the result backend only hold one chunk at a time.
+    Chunks do not overlap: a chunk is sent when every set of the chunk before it is done, the workers left idle
+    by a slow set wait for it. The sets are sent longest first, so slow sets share the first chunks, and a task
+    with at most TASK_CHUNK_SIZE sets has no barrier; raise TASK_CHUNK_SIZE when idle workers cost more than
+    the memory of the broker.
+    The rows of the sets run per parameter row are put in the header of the chord, chords are not nested, their
+    results are saved by the callback
+    :param pending: [set id, counter] of the sets not sent yet, type(list)
+    :param errors: errors of the sets of the chunks already finished, type(list)
+    """
+    chunk, pending = pending[:TASK_CHUNK_SIZE], pending[TASK_CHUNK_SIZE:]
+    # the sets of the chunk may wait in the queue before any of them beats
+    touch(batch)
+    options = queue_options(interactive)
+    header = []
+    layout = []
+    for set_id, counter in chunk:
+        signatures, parameterized = set_header(set_id, batch, category, 'tasks', task_id, counter, cassette,
+                                               interactive=interactive)
+        header.extend(signatures)
+        layout.append([set_id, len(signatures) if parameterized else None])
+    if not pending and not errors and not any(rows for _, rows in layout):
+        callback = save_task_result.s(task_id, batch)
     else:
-        test_sets = queryset.filter(tags__contains=tags)
+        callback = save_task_chunk.s(task_id, batch, category, pending, errors, cassette, interactive, layout)
+    logger.info("task: {}, batch: {}, send {} sets, {} sets pending".format(task_id, batch, len(chunk),
+                                                                        len(pending)))
+    chord(header, callback.set(retry_policy={
+        'interval_step': 1,
+        'interval_max': 2
+    }, **options))()
+
+
+def set_errors(results, task_id, batch, layout=None):
+    """
+    :param results: results of the header of a chunk, type(list)
+    :param layout: [set id, number of signatures] of the sets of the chunk, None for a set run once, type(list)
+    :return: error of every set of the chunk, the results of the sets run per parameter row are saved first,
+             type(list)
+    """
+    if layout is None:
+        return results
+    errors = []
+    index = 0
+    for set_id, rows in layout:
+        if rows is None:
+            errors.append(results[index])
+            index += 1
+        else:
+            errors.append(save_set_result(results[index:index + rows], set_id, batch, 'tasks', task_id))
+            index += rows
+    return errors
 
-    instance = Tasks.objects.get(id=task_id)
-    ret = instance.counters
-    if ret.exists():
-        counter = ret.first()
-        num_generator = (i for i in range(counter.initial, counter.final, counter.step))
-        num = cycle(num_generator)
-
-        chord((run_set.s(testSet.id, batch, category, 'tasks', task_id,
-                         {counter.name: str(next(num))})
-               for testSet in test_sets),
-              save_task_result.s(task_id, batch).set(retry_policy={
-                  'interval_step': 1,
-                  'interval_max': 2
-              }))()
+
+@shared_task
+def save_task_chunk(results, task_id, batch, category, pending, errors=None, cassette=None, interactive=True,
+                    layout=None):
+    """
+    Keep only the errors of a finished chunk of sets, then send the next chunk or save the result of the task.
+    It runs when the slowest set of the chunk is done, see send_sets
+    :param results: results of the header of the finished chunk, type(list)
+    :param layout: sets of the chunk, see set_errors, type(list)
+    """
+    errors = (errors or []) + [error for error in set_errors(results, task_id, batch, layout) if error]
+    if pending:
+        send_sets(task_id, batch, category, pending, errors, cassette, interactive)
     else:
-        chord((run_set.s(testSet.id, batch, category, 'tasks', task_id)
-               for testSet in test_sets),
-              save_task_result.s(task_id, batch).set(retry_policy={
-                  'interval_step': 1,
-                  'interval_max': 2
-              }))()
+        save_task_result(errors, task_id, batch)
+
+
+@shared_task
+def run_task(task_id, batch, tags, category, cassette=None, sets=None, interactive=True):
+    record_queue_wait(batch, tasks_id=task_id)
+    try:
+        send_task(task_id, batch, tags, category, cassette, sets, interactive)
+    except Exception:
+        locks.release('tasks', task_id, batch)
+        resume_periodic(task_id)
+        raise
+
 
+def send_task(task_id, batch, tags, category, cassette=None, sets=None, interactive=True):
+    # the longest sets are sent first so none of them starts last and drags out the chord
+    plan, makespan = schedule(select_sets(task_id, tags, sets))
+    logger.info("task: {}, batch: {}, predicted makespan: {:.1f}s".format(task_id, batch, makespan))
 
-def run(level, obj_id, batch, tags=None, category=None):
+    instance = Tasks.objects.get(id=task_id)
+    counter = instance.counters.first()
+    if counter:
+        num = cycle(range(counter.initial, counter.final, counter.step))
+        pending = [[str(test_set.id), {counter.name: str(next(num))}] for test_set, _, _ in plan]
+    else:
+        pending = [[str(test_set.id), None] for test_set, _, _ in plan]
+    send_sets(task_id, batch, category, pending, cassette=cassette, interactive=interactive)
+
+
+def run(level, obj_id, batch, tags=None, category=None, options=None, cassette=None, failed=None, interactive=True):
+    """
+    :param failed: ids of the failed sets of the task, or of the failed cases relations of the set, only they are
+                   run when given, type(list)
+    :param interactive: run started by a user, or by a periodic task, type(bool)
+    """
+    routing = queue_options(interactive, category)
+    # the run may wait in a backlogged queue, the reaper must not take it as orphaned before a worker beats
+    touch(batch)
     if level == 'cases':
-        run_case.apply_async((obj_id, batch, category))
+        run_case.apply_async((obj_id, batch, category, cassette), **routing)
     elif level == 'sets':
-        run_set.apply_async((obj_id, batch, category))
+        set_signature(obj_id, batch, category, cassette=cassette, relations=failed,
+                      interactive=interactive).apply_async()
     elif level == 'tasks':
-        run_task.apply_async((obj_id, batch, tags, category))
+        # the task only sends its sets, it does not wait for a browser worker
+        run_task.apply_async((obj_id, batch, tags, category, cassette, failed, interactive),
+                             **queue_options(interactive))
+    elif level == 'load':
+        # load runs last long, they would hold the capacity kept for interactive runs
+        run_load.apply_async((obj_id, batch, options), **queue_options(interactive=False))
 
 
 @shared_task
-def periodic_task(task_id, tags=None, category=None):
+def periodic_task(task_id, tags=None, category=None, periodic=None, pending=False):
+    """
+    Start a run of the task for a tick of its periodic task, what happens while the previous run is going is
+    decided by the overlap of the periodic task and recorded as a PeriodicTrigger
+    :param periodic: id of the periodic task, periodic tasks created before it was sent are taken as skip, type(int)
+    :param pending: the tick waited for the previous run, type(bool)
+    """
     logger.info("periodic task, args: {} {}".format(task_id, tags))
+    overlap = PeriodicTask.objects.filter(id=periodic).values_list('overlap', flat=True).first()
     batch = generate_uuid()
-    Start(task_id, 'tasks', batch).run()
-    run('tasks', task_id, batch, tags, category)
+    try:
+        Start(task_id, 'tasks', batch).run(exclusive=overlap != OVERLAP_CONCURRENT)
+    except Conflict as e:
+        decision = 'skipped'
+        if overlap == OVERLAP_QUEUE:
+            marked = mark_pending(task_id, periodic)
+            decision = {True: 'queued', False: 'coalesced'}.get(marked, decision)
+        record_trigger(task_id, periodic, decision, message=str(e.detail))
+        # the run may be done before the marker is set
+        if decision == 'queued' and not locks.holder('tasks', task_id):
+            resume_periodic(task_id)
+        return decision
+    run('tasks', task_id, batch, tags, category, interactive=False)
+    record_trigger(task_id, periodic, 'started', batch=batch, message=pending and 'waited for the previous run' or None)
+    return 'started'
+
+
+def resume_periodic(task_id):
+    """
+    Send the periodic run waiting for the run of the task which is done
+    """
+    periodic = pop_pending(task_id)
+    if not periodic:
+        return
+    instance = PeriodicTask.objects.filter(id=periodic).values('tags', 'category').first()
+    if instance:
+        periodic_task.delay(str(task_id), instance['tags'], instance['category'], int(periodic), True)
@@ -1,3 +1,708 @@
-from django.test import TestCase
+import os
+import json
+import uuid
+import time
+import signal
+import socket
+import subprocess
+import string
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+import celery
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from cronus.settings import MEDIA_ROOT, PRIVATE_ROOT, CASSETTE_DIR, RUN_LOCK_TTL, RUN_LOCK_MIN_TTL, \
+    RUN_LOCK_TTL_FACTOR
+from services.models import Projects, Config, Cases, Sets, Tasks, CasesRelationShip, SetsRelationShip, Histories, \
+    LoadSummary
+from services.parameters import parse_csv
+from services.runner import CasesRunner, SetsRunner
+from services.context import RunContext
+from services.configs import ConfigCache
+from services.load import BUCKETS, LoadRunner, LoadStats
+from services.retention import prune_histories
+from services.utils import generate_uuid
+from services.dependency import DependencyGraph
+from services import storage, cassette, heartbeat, reaper, runner, serializers, tasks, locks, buffer
+from services.progress import Progress
+from services.exceptions import ParseResponseErr, Conflict
+from services.substitute import CompiledTemplate, Parser
 
-# Create your tests here.
+
+def relation(name, url='/', extracts=None, variables=None):
+    case = SimpleNamespace(name=name, url=url, headers={}, body={}, variables=variables or {},
+                           extracts=[{'name': extract} for extract in extracts or []])
+    return SimpleNamespace(cases=case)
+
+
+def run_graph(relations, func, workers=4, stop=None):
+    """
+    Run the graph in a thread, so a graph which never returns fails the test instead of hanging it
+    """
+    graph = DependencyGraph(relations)
+    ret = {}
+    thread = threading.Thread(target=lambda: ret.update(errors=graph.run(func, workers, stop=stop)), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), 'graph did not finish'
+    return graph, ret['errors']
+
+
+def test_dependency_order():
+    login = relation('login', extracts=['token'])
+    profile = relation('profile', url='/users/${token}')
+    other = relation('other', url='/other')
+    finished = []
+    lock = threading.Lock()
+
+    def func(item):
+        with lock:
+            finished.append(item.cases.name)
+
+    graph, errors = run_graph([login, profile, other], func)
+    assert errors == []
+    assert finished.index('login') < finished.index('profile')
+    assert sorted(finished) == ['login', 'other', 'profile']
+    assert graph.nodes[1].depends_on(graph.nodes[0])
+    assert not graph.nodes[2].depends_on(graph.nodes[0])
+
+
+def test_own_variables_are_not_dependencies():
+    login = relation('login', extracts=['token'])
+    profile = relation('profile', url='/users/${token}', variables={'token': 'fixed'})
+    graph = DependencyGraph([login, profile])
+    assert not graph.nodes[1].depends_on(graph.nodes[0])
+
+
+def test_errors_in_relation_order():
+    relations = [relation('a'), relation('b'), relation('c')]
+
+    def func(item):
+        if item.cases.name != 'b':
+            return '{} failed'.format(item.cases.name)
+
+    _, errors = run_graph(relations, func)
+    assert errors == ['a failed', 'c failed']
+
+
+def test_stop_skips_dependents():
+    login = relation('login', extracts=['token'])
+    profile = relation('profile', url='/users/${token}')
+
+    def func(item):
+        return 'failed' if item.cases.name == 'login' else None
+
+    graph, errors = run_graph([login, profile], func, stop=lambda item, error: bool(error))
+    assert errors == ['failed']
+    assert graph.skipped == [profile]
+
+
+def test_raising_node_does_not_block():
+    login = relation('login', extracts=['token'])
+    profile = relation('profile', url='/users/${token}')
+
+    def func(item):
+        if item.cases.name == 'login':
+            raise ParseResponseErr('failed to query key token')
+
+    graph, errors = run_graph([login, profile], func, workers=2)
+    assert len(errors) == 1 and 'failed to query key token' in errors[0]
+    assert graph.skipped == []
+
+
+@pytest.mark.parametrize('template', [
+    '$a', '${a}', 'x${a}y$b', '$$', '$$a', '$$${a}', '$', 'a $', '$ a', '${', '${a', '${ a}', '$1', '${1}',
+    '$missing', '${missing}', '$a$missing$b', '$a_b', '$a.b', '$a-b', '', 'no variables', '{"k": "$a"}',
+])
+@pytest.mark.parametrize('variables', [{}, {'a': 1, 'b': 'two', 'a_b': None}])
+def test_compiled_template_equals_safe_substitute(template, variables):
+    expected = string.Template(template).safe_substitute(variables)
+    assert CompiledTemplate(template).substitute(variables) == expected
+    assert Parser(Parser.compile(template), variables).parser() == expected
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({'b': 1}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), JsonHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def create_case(baseurl, asserts=None, proxy=None, name='case'):
+    """
+    :return: case asserting the response of the server, its status code when asserts is None, type(Cases)
+    """
+    project, created = Projects.objects.get_or_create(name='demo')
+    if created:
+        Config.objects.create(name='config', baseurl=baseurl, headers={}, variables={}, proxy=proxy or [],
+                              globalConfig=True, project=project)
+    return Cases.objects.create(name=name, url='/', method='GET', project=project, headers={}, body={},
+                                asserts=asserts or [{'select': 'code', 'comparator': 'equal',
+                                                     'expected_value': '200'}])
+
+
+def unparsable_case(baseurl):
+    """
+    :return: case asserting a json key missing from the response of the server, type(Cases)
+    """
+    return create_case(baseurl, asserts=[{'select': 'text', 'comparator': 'equal', 'match_type': 'json',
+                                          'expression': '$.[a]', 'expected_value': '1'}])
+
+
+@pytest.mark.django_db
+def test_unparsable_assertion_fails_the_case(server):
+    case = unparsable_case(server)
+    test_set = Sets.objects.create(name='set', project=case.project, tags=[])
+    relation = CasesRelationShip.objects.create(cases=case, sets=test_set, order=1, level='sets')
+    batch = generate_uuid()
+    test_set.history.create(status='Starting', batch=batch)
+
+    SetsRunner(str(test_set.id), batch).run()
+
+    history = relation.history.get()
+    assert (history.status, history.result) == ('Done', 'Failed')
+    assert 'failed to query json' in history.error_message
+    assert test_set.history.get(batch=batch).result == 'Failed'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_unparsable_assertion_counts_as_load_error(server):
+    case = unparsable_case(server)
+    batch = generate_uuid()
+    LoadSummary.objects.create(cases=case, batch=batch, status='Starting')
+
+    LoadRunner(str(case.id), batch, concurrency=2, iterations=4).run()
+
+    summary = case.load.get(batch=batch)
+    assert (summary.status, summary.result) == ('Done', 'Failed')
+    assert (summary.requests, summary.errors) == (4, 4)
+    assert 'failed to query json' in summary.error_message
+
+
+def test_private_root_is_not_served():
+    private, media = os.path.abspath(PRIVATE_ROOT), os.path.abspath(MEDIA_ROOT)
+    assert os.path.commonpath([private, media]) != media
+
+
+@pytest.fixture
+def private_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'PRIVATE_ROOT', str(tmp_path))
+    monkeypatch.setattr(storage, 'RESPONSE_INLINE_LIMIT', 100)
+    return tmp_path
+
+
+def test_small_response_is_inline(private_root):
+    response = {'status_code': 200, 'text': 'ok'}
+    assert storage.store_response(response) == response
+    assert list(private_root.iterdir()) == []
+
+
+def test_large_response_is_stored_out_of_media(private_root):
+    response = {'status_code': 200, 'headers': {}, 'text': 'x' * 1000}
+    stored = storage.store_response(response)
+    assert stored['status_code'] == 200 and 'text' not in stored
+    assert (private_root / stored['blob']['path']).exists()
+    assert storage.load_response(stored) == response
+    # the same content is stored once
+    assert storage.store_response(dict(response)) == stored
+
+
+@pytest.mark.django_db(transaction=True)
+def test_response_file_removed_with_its_last_history(private_root):
+    stored = storage.store_response({'status_code': 200, 'text': 'x' * 1000})
+    first, second = Histories.objects.create(response=stored), Histories.objects.create(response=stored)
+    path = private_root / stored['blob']['path']
+
+    first.delete()
+    assert path.exists()
+    second.delete()
+    assert not path.exists()
+
+
+def test_cassette_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(cassette, 'PRIVATE_ROOT', str(tmp_path))
+    monkeypatch.setattr(cassette, 'CASSETTE_CACHE_SIZE', 2)
+    monkeypatch.setattr(cassette, 'cassettes', OrderedDict())
+    (tmp_path / CASSETTE_DIR).mkdir()
+    for case_id in ('a', 'b', 'c'):
+        (tmp_path / CASSETTE_DIR / '{}.json'.format(case_id)).write_text(json.dumps(
+            {'case': case_id, 'interactions': {'GET /{}'.format(case_id): {}}}))
+
+    assert cassette.load('a') == {'GET /a': {}}
+    cassette.load('b')
+    cassette.load('a')
+    cassette.load('c')
+    # the least recently replayed cassette is dropped first
+    assert [os.path.basename(path) for path in cassette.cassettes] == ['a.json', 'c.json']
+
+
+def test_reaper_kills_only_the_recorded_process_tree():
+    process = subprocess.Popen(['sh', '-c', 'sleep 30 & wait'])
+    try:
+        deadline = time.time() + 5
+        while len(reaper._tree(process.pid)) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        tree = reaper._tree(process.pid)
+        start = heartbeat.process_start(process.pid)
+        record = {'host': socket.gethostname(), 'time': time.time()}
+
+        # the pid was reused by another process
+        reaper._kill({'worker': dict(record, drivers=[[process.pid, start + 1]])})
+        assert process.poll() is None
+
+        reaper._kill({'worker': dict(record, drivers=[[process.pid, start]])})
+        assert process.wait(5) == -signal.SIGKILL
+        # the orphaned sleep stays a zombie until its new parent reaps it
+        deadline = time.time() + 5
+        while any((heartbeat.process_stat(pid) or ['Z'])[0] != 'Z' for pid in tree) and time.time() < deadline:
+            time.sleep(0.05)
+        assert len(tree) == 2 and all((heartbeat.process_stat(pid) or ['Z'])[0] == 'Z' for pid in tree)
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('beats, orphaned', [
+    ({}, True),
+    (None, False),
+    ({'worker': {'time': -3600}}, True),
+    ({'worker': {'time': -60}}, False),
+    ({'worker': {'time': -7200}, 'dispatch': {'time': -3600, 'queued': True}}, False),
+    ({'dispatch': {'time': -7200, 'queued': True}, 'worker': {'time': -3600}}, True),
+    ({'dispatch': {'time': -RUN_LOCK_TTL - 60, 'queued': True}}, True),
+])
+def test_reaper_orphaned(monkeypatch, beats, orphaned):
+    now = timezone.now()
+    batch = generate_uuid()
+    Histories.objects.create(status='Starting', batch=batch, start_time=now - timedelta(seconds=RUN_LOCK_TTL))
+    Histories.objects.create(status='Starting', batch=generate_uuid(), start_time=now)
+    if beats is not None:
+        beats = {name: dict(beat, time=now.timestamp() + beat['time']) for name, beat in beats.items()}
+    monkeypatch.setattr(heartbeat, 'beats', lambda key: beats)
+    assert list(reaper.orphaned(now)) == ([batch] if orphaned else [])
+
+
+@pytest.mark.django_db
+def test_configured_proxy_wins_over_environment(server, monkeypatch):
+    monkeypatch.setenv('HTTP_PROXY', 'http://127.0.0.1:9')
+    host, port = server.rsplit('/', 1)[1].split(':')
+    # the server answers any url, so the request only succeeds through the configured proxy
+    case = create_case('http://cronus.invalid', proxy=[{'scheme': 'http', 'protocol': 'http', 'ip': host,
+                                                        'port': port, 'username': 'user', 'password': 'secret'}])
+    context = RunContext(generate_uuid(), ConfigCache.get(case.project_id, 'api'))
+    try:
+        case_runner = CasesRunner(case, generate_uuid(), context=context, category='api')
+        case_runner.execute()
+    finally:
+        context.release()
+    assert (case_runner.result, case_runner.error) == ('Succeed', None)
+
+
+@pytest.mark.django_db
+def test_set_cancelled_mid_run_is_not_succeed(server, monkeypatch):
+    first, second = create_case(server, name='first'), create_case(server, name='second')
+    test_set = Sets.objects.create(name='set', project=first.project, tags=[])
+    for order, case in enumerate((first, second)):
+        CasesRelationShip.objects.create(cases=case, sets=test_set, order=order, level='sets')
+    batch = generate_uuid()
+    test_set.history.create(status='Starting', batch=batch)
+    # a sibling set of the task fails while the first case runs
+    counts = iter([0, 1, 1])
+    monkeypatch.setattr(runner, 'failure_count', lambda key: next(counts))
+
+    sets_runner = SetsRunner(str(test_set.id), batch)
+    sets_runner.failure_threshold = 1
+    sets_runner.run()
+
+    history = test_set.history.get(batch=batch)
+    assert history.result == 'Skipped'
+    assert history.error_message.startswith('cancelled, 1 sets of the task failed, 1 cases skipped')
+    assert sorted(Histories.objects.filter(batch=batch, set_cases__isnull=False).values_list(
+        'result', flat=True)) == ['Skipped', 'Succeed']
+
+
+@pytest.fixture
+def api_client(access_token):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(access_token))
+    return client
+
+
+@pytest.fixture
+def published(monkeypatch):
+    events = []
+    monkeypatch.setattr(Progress, 'publish', lambda self, event, **fields: events.append(dict(fields, event=event)))
+    return events
+
+
+@pytest.mark.django_db
+def test_load_run_returns_its_batch(api_client, monkeypatch):
+    case = create_case('http://cronus.invalid')
+    sent = []
+    monkeypatch.setattr(serializers, 'run', lambda *args: sent.append(args))
+    response = api_client.post(reverse('execute-list'), data={
+        'id': str(case.id), 'level': 'load', 'category': 'api', 'target': 'cases', 'iterations': 2}, format='json')
+
+    assert response.status_code == 201
+    batch = uuid.UUID(response.data['batch']).hex
+    assert sent[0][:3] == ('load', str(case.id), batch)
+    assert case.load.get().batch.hex == batch
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_run_publishes_done(server, published):
+    case = create_case(server)
+    batch = generate_uuid()
+    LoadSummary.objects.create(cases=case, batch=batch, status='Starting')
+
+    LoadRunner(str(case.id), batch, iterations=3).run()
+
+    assert [event['event'] for event in published] == ['load', 'load', 'done']
+    assert published[0]['status'] == 'Starting'
+    assert (published[1]['status'], published[1]['requests'], published[1]['errors']) == ('Done', 3, 0)
+    assert published[2]['result'] == 'Succeed'
+
+
+@pytest.mark.django_db
+def test_task_chord_header_is_flat(monkeypatch):
+    project = Projects.objects.create(name='demo')
+    task = Tasks.objects.create(name='task', project=project)
+    rows = Sets.objects.create(name='rows', project=project, tags=[], parameter_concurrency=2,
+                               parameters=parse_csv(b'user\nal\nbo\ncy\n'))
+    plain = Sets.objects.create(name='plain', project=project, tags=[])
+    for test_set in (rows, plain):
+        SetsRelationShip.objects.create(tasks=task, sets=test_set)
+    sent = []
+    monkeypatch.setattr(tasks, 'touch', lambda batch: None)
+    monkeypatch.setattr(tasks, 'chord', lambda header, callback: sent.append((header, callback)) or (lambda: None))
+
+    tasks.send_sets(str(task.id), generate_uuid(), 'api', [[str(rows.id), None], [str(plain.id), None]])
+
+    header, callback = sent[0]
+    # two chunks of rows and the plain set, no chord is nested in the header
+    assert len(header) == 3 and not any(isinstance(signature, celery.chord) for signature in header)
+    assert callback.task == tasks.save_task_chunk.name
+    assert callback.args[-1] == [[str(rows.id), 2], [str(plain.id), None]]
+
+
+def test_set_errors_of_a_flat_chunk(monkeypatch):
+    saved = []
+
+    def save_set_result(results, set_id, batch, level, task_id):
+        saved.append((results, set_id, level))
+        return 'rows failed'
+
+    monkeypatch.setattr(tasks, 'save_set_result', save_set_result)
+    results = [['row error', None], [None], 'set error', None]
+    layout = [['rows', 2], ['failed', None], ['passed', None]]
+    assert tasks.set_errors(results, 'task', 'batch', layout) == ['rows failed', 'set error', None]
+    assert saved == [([['row error', None], [None]], 'rows', 'tasks')]
+    # chunks sent before the header was flattened
+    assert tasks.set_errors(results, 'task', 'batch') == results
+
+
+def create_histories(case, ages, status='Done'):
+    """
+    :param ages: days since the start of every history, type(list)
+    :return: ids of the histories, type(list)
+    """
+    now = timezone.now()
+    return [case.history.create(status=status, result='Succeed', start_time=now - timedelta(days=age)).id
+            for age in ages]
+
+
+@pytest.mark.django_db
+def test_prune_keeps_the_newest_histories():
+    case = create_case('http://cronus.invalid')
+    Projects.objects.filter(id=case.project_id).update(history_count=2, history_days=None)
+    newest = create_histories(case, [1, 2])
+    create_histories(case, [3, 4])
+    running = create_histories(case, [5], status='Starting')
+
+    assert prune_histories() == 2
+    assert sorted(case.history.values_list('id', flat=True)) == sorted(newest + running)
+
+
+@pytest.mark.django_db
+def test_prune_histories_older_than_the_project_days():
+    case = create_case('http://cronus.invalid')
+    Projects.objects.filter(id=case.project_id).update(history_count=100, history_days=7)
+    recent = create_histories(case, [1, 6])
+    create_histories(case, [8, 30])
+    running = create_histories(case, [30], status='Starting')
+    case.load.create(status='Done', start_time=timezone.now() - timedelta(days=8))
+    case.load.create(status='Done', start_time=timezone.now() - timedelta(days=1))
+
+    assert prune_histories() == 3
+    assert sorted(case.history.values_list('id', flat=True)) == sorted(recent + running)
+    assert case.load.count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_prune_removes_the_response_files(private_root):
+    case = create_case('http://cronus.invalid')
+    Projects.objects.filter(id=case.project_id).update(history_count=1, history_days=None)
+    stored = storage.store_response({'status_code': 200, 'text': 'x' * 1000})
+    case.history.create(status='Done', start_time=timezone.now() - timedelta(days=2), response=stored)
+    create_histories(case, [1])
+
+    assert prune_histories() == 1
+    assert not (private_root / stored['blob']['path']).exists()
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeRedis(object):
+    """
+    The commands of redis used by the run locks and the result buffer
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def hset(self, key, field, value):
+        self.values.setdefault(key, {})[field] = value
+
+    def hgetall(self, key):
+        return dict(self.values.get(key, {}))
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.values.get(key, {}).pop(field, None)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.ttls[key] = ex
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def eval(self, script, numkeys, key, value):
+        assert script == locks.RELEASE_SCRIPT
+        if self.values.get(key) == value:
+            del self.values[key]
+            return 1
+        return 0
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedis()
+    for module in (locks, buffer):
+        monkeypatch.setattr(module, 'get_redis', lambda: client)
+    return client
+
+
+@pytest.mark.django_db
+def test_run_lock_is_held_by_one_run(fake_redis):
+    test_set = Sets.objects.create(name='set', project=Projects.objects.create(name='demo'), tags=[],
+                                   duration_ema=200)
+    assert locks.acquire('sets', test_set.id, 'first') is True
+    assert locks.acquire('sets', test_set.id, 'second') is False
+    assert fake_redis.ttls[locks.lock_key('sets', test_set.id)] == max(RUN_LOCK_MIN_TTL, 200 * RUN_LOCK_TTL_FACTOR)
+
+    # a run whose lock expired and was taken by a later run does not release it
+    locks.release('sets', test_set.id, 'second')
+    assert locks.holder('sets', test_set.id) == 'first'
+    locks.release('sets', test_set.id, 'first')
+    assert locks.holder('sets', test_set.id) is None
+    assert locks.acquire('sets', test_set.id, 'second') is True
+
+
+@pytest.mark.django_db
+def test_start_without_redis_checks_running_histories(monkeypatch):
+    monkeypatch.setattr(locks, 'get_redis', lambda: None)
+    test_set = Sets.objects.create(name='set', project=Projects.objects.create(name='demo'), tags=[])
+    tasks.Start(str(test_set.id), 'sets', generate_uuid()).run()
+    with pytest.raises(Conflict):
+        tasks.Start(str(test_set.id), 'sets', generate_uuid()).run()
+    # periodic runs allowed to overlap are not checked
+    tasks.Start(str(test_set.id), 'sets', generate_uuid()).run(exclusive=False)
+    assert test_set.history.filter(status='Starting').count() == 2
+
+
+@pytest.mark.django_db
+def test_running_set_answers_409(api_client, fake_redis, monkeypatch):
+    test_set = Sets.objects.create(name='set', project=Projects.objects.create(name='demo'), tags=[])
+    sent = []
+    monkeypatch.setattr(serializers, 'run', lambda *args: sent.append(args))
+    data = {'id': str(test_set.id), 'level': 'sets', 'category': 'api'}
+
+    assert api_client.post(reverse('execute-list'), data=data, format='json').status_code == 201
+    response = api_client.post(reverse('execute-list'), data=data, format='json')
+    assert response.status_code == 409
+    assert len(sent) == 1 and test_set.history.count() == 1
+
+    locks.release('sets', test_set.id, sent[0][2])
+    assert api_client.post(reverse('execute-list'), data=data, format='json').status_code == 201
+
+
+def test_load_percentiles_are_nearest_rank():
+    stats = LoadStats()
+    for latency in range(100, 0, -1):
+        stats.add(float(latency), error='timeout' if latency > 95 else None)
+    summary = stats.summary(elapsed=10)
+
+    assert (summary['p50'], summary['p90'], summary['p99']) == (50, 90, 99)
+    assert (summary['minimum'], summary['maximum'], summary['mean']) == (1, 100, 50.5)
+    assert (summary['requests'], summary['errors'], summary['error_rate'], summary['throughput']) == (
+        100, 5, 0.05, 10)
+    assert stats.error_message() == 'timeout (x5)'
+
+
+@pytest.mark.parametrize('latencies, p50, p99', [
+    ([7], 7, 7),
+    ([1, 2], 1, 2),
+    ([3, 1, 2], 2, 3),
+])
+def test_load_percentiles_of_few_samples(latencies, p50, p99):
+    stats = LoadStats()
+    for latency in latencies:
+        stats.add(latency)
+    summary = stats.summary(elapsed=1)
+    assert (summary['p50'], summary['p99']) == (p50, p99)
+
+
+def test_load_histogram_buckets_are_upper_bounds():
+    stats = LoadStats()
+    for latency in (0.5, 1, 1.5, 1000, 1000.1, 90000):
+        stats.add(latency)
+    histogram = {bucket['le']: bucket['count'] for bucket in stats.summary(elapsed=1)['histogram']}
+
+    assert [bucket['le'] for bucket in stats.summary(elapsed=1)['histogram']] == list(BUCKETS) + ['+Inf']
+    assert (histogram[1], histogram[2], histogram[1000], histogram[2000], histogram['+Inf']) == (2, 1, 1, 1, 1)
+    assert sum(histogram.values()) == 6
+
+
+def test_load_summary_without_requests():
+    summary = LoadStats().summary(elapsed=0)
+    assert (summary['requests'], summary['error_rate'], summary['throughput']) == (0, 0, 0)
+    assert 'p50' not in summary and sum(bucket['count'] for bucket in summary['histogram']) == 0
+
+
+def test_load_error_samples_are_bounded():
+    stats = LoadStats(max_samples=2)
+    for error in ('a', 'b', 'c', 'a'):
+        stats.add(1, error=error)
+    assert stats.errors == 4
+    assert stats.error_message() == 'a (x2); b (x1)'
+
+
+def create_relations(count):
+    test_set = Sets.objects.create(name='set', project=Projects.objects.create(name='demo'), tags=[])
+    return [CasesRelationShip.objects.create(cases=Cases.objects.create(
+        name='case {}'.format(index), project=test_set.project), sets=test_set, order=index, level='sets')
+        for index in range(count)]
+
+
+@pytest.mark.django_db
+def test_buffer_publishes_running_cases_and_writes_finished_ones(fake_redis):
+    first, second = create_relations(2)
+    batch = generate_uuid()
+    results = buffer.ResultBuffer(batch, interval=3600, size=100)
+    running = results.start(first, timezone.now())
+    results.start(second, timezone.now())
+
+    results.flush()
+    assert not Histories.objects.filter(batch=batch).exists()
+    assert set(buffer.live_status(batch)) == {str(first.id), str(second.id)}
+
+    results.finish(running, status='Done', result='Succeed')
+    results.flush()
+    assert list(Histories.objects.filter(batch=batch).values_list('set_cases', 'result')) == [(first.id, 'Succeed')]
+    assert set(buffer.live_status(batch)) == {str(second.id)}
+    assert results.flushes == 1
+
+
+@pytest.mark.django_db
+def test_buffer_without_redis_writes_running_cases(monkeypatch):
+    monkeypatch.setattr(buffer, 'get_redis', lambda: None)
+    relation, skipped = create_relations(2)
+    batch = generate_uuid()
+    results = buffer.ResultBuffer(batch, interval=3600, size=100)
+    history = results.start(relation, timezone.now())
+    results.flush()
+    assert relation.history.get().status == 'Starting'
+
+    results.finish(history, status='Done', result='Failed', error_message='failed')
+    results.skip([skipped], reason='stopped')
+    results.flush()
+    assert (relation.history.get().status, relation.history.get().result) == ('Done', 'Failed')
+    assert (skipped.history.get().result, skipped.history.get().error_message) == ('Skipped', 'stopped')
+    assert not results.pending
+
+
+@pytest.mark.django_db
+def test_buffer_flushes_when_full(fake_redis):
+    first, second = create_relations(2)
+    batch = generate_uuid()
+    results = buffer.ResultBuffer(batch, interval=3600, size=2)
+    results.finish(results.start(first, timezone.now()), status='Done', result='Succeed')
+    assert not Histories.objects.filter(batch=batch).exists()
+
+    results.start(second, timezone.now())
+    assert results.flushes == 1
+    assert list(Histories.objects.filter(batch=batch).values_list('set_cases', flat=True)) == [first.id]
+    assert set(buffer.live_status(batch)) == {str(second.id)}
+
+
+@pytest.mark.django_db
+def test_history_list_has_the_live_status(api_client, fake_redis):
+    running, done = create_relations(2)
+    batch = generate_uuid()
+    results = buffer.ResultBuffer(batch, interval=3600, size=100)
+    results.start(running, timezone.now())
+    results.finish(results.start(done, timezone.now()), status='Done', result='Succeed')
+    results.flush()
+
+    for value in (str(uuid.UUID(batch)), batch):
+        response = api_client.get(reverse('history-list'), {'types': 'set_cases', 'id': str(running.sets_id),
+                                                            'batch': value})
+        assert response.status_code == 200
+        statuses = {item['id']: item['history'] and item['history']['status'] for item in response.data}
+        assert statuses == {str(running.id): 'Starting', str(done.id): 'Done'}
+
+    response = api_client.get(reverse('history-list'), {'types': 'set_cases', 'id': str(running.sets_id),
+                                                        'batch': 'latest'})
+    assert response.status_code == 400
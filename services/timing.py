@@ -0,0 +1,68 @@
+import time
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+# seconds spent opening connections (TCP and TLS handshakes) by the current thread
+recorder = threading.local()
+
+
+def reset():
+    recorder.connect = 0.0
+
+
+def connect_time():
+    return getattr(recorder, 'connect', 0.0)
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super(TimedHTTPConnection, self).connect()
+        finally:
+            recorder.connect = connect_time() + time.perf_counter() - start
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super(TimedHTTPSConnection, self).connect()
+        finally:
+            recorder.connect = connect_time() + time.perf_counter() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections record how long opening them took, reused connections record nothing
+    """
+    pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool
+    }
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes_by_scheme
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super(TimedAdapter, self).proxy_manager_for(proxy, **proxy_kwargs)
+        # socks proxies come with their own connection classes
+        if not proxy.lower().startswith('socks'):
+            manager.pool_classes_by_scheme = self.pool_classes_by_scheme
+        return manager
@@ -4,7 +4,7 @@ from rest_framework.routers import DefaultRouter
 from services.views import ProjectViewSet, ConfigViewSet, CounterViewSet, CasesViewSet, SetsViewSet, TasksViewSet, \
     CaseBindingViewSet, OrderViewSet, UnboundCaseViewSet, ConfigBindingViewSet, CounterBindingViewSet, \
     SetBindingViewSet, UnboundSetsViewSet, RunnerViewSet, HistoryViewSet, ReportViewSet, CronScheduleViewSet, \
-    PeriodicTaskViewSet
+    PeriodicTaskViewSet, LoadViewSet, ResponseViewSet, ParameterViewSet, ScheduleViewSet, PeriodicTriggerViewSet
 
 
 router = DefaultRouter()
@@ -14,6 +14,7 @@ router.register('counter', CounterViewSet, basename='counter')
 router.register('cases', CasesViewSet, basename='cases')
 router.register('sets', SetsViewSet, basename='sets')
 router.register('tasks', TasksViewSet, basename='tasks')
+router.register('parameters', ParameterViewSet, basename='parameters')
 router.register('binding/cases', CaseBindingViewSet, basename='binding_cases')
 router.register('ordering', OrderViewSet, basename='ordering')
 router.register('unbound/cases', UnboundCaseViewSet, basename='unbound_cases')
@@ -23,9 +24,13 @@ router.register('binding/sets', SetBindingViewSet, basename='binding_sets')
 router.register('unbound/sets', UnboundSetsViewSet, basename='unbound_sets')
 router.register('execute', RunnerViewSet, basename='execute')
 router.register('history', HistoryViewSet, basename='history')
+router.register('history/response', ResponseViewSet, basename='history_response')
 router.register('report', ReportViewSet, basename='report')
+router.register('schedule', ScheduleViewSet, basename='schedule')
+router.register('load', LoadViewSet, basename='load')
 router.register('cron', CronScheduleViewSet, basename='cron')
 router.register('periodic', PeriodicTaskViewSet, basename='periodic')
+router.register('triggers', PeriodicTriggerViewSet, basename='triggers')
 
 
 urlpatterns = [
@@ -2,9 +2,12 @@ import os
 import time
 import uuid
 import logging
+import redis
+from cronus.settings import REDIS_URL
 
 
 logger = logging.getLogger()
+redis_client = None
 
 
 def remove_file(file_path):
@@ -15,3 +18,18 @@ def remove_file(file_path):
 
 def generate_uuid():
     return str(uuid.uuid5(uuid.NAMESPACE_OID, str(time.time()))).replace('-', '')
+
+
+def get_redis():
+    """
+    Redis client shared by the process, commands raise redis.RedisError when the server is not reachable
+    :return: object of redis.Redis, None when REDIS_URL is not a redis url
+    """
+    global redis_client
+    if redis_client is None:
+        try:
+            redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2,
+                                                decode_responses=True)
+        except ValueError as e:
+            logger.error("invalid redis url: {}, {}".format(REDIS_URL, e))
+    return redis_client
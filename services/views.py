@@ -1,16 +1,23 @@
 import os
 import json
+import uuid
 import logging
 from django.db.models.query import QuerySet
 from rest_framework import viewsets, mixins
+from rest_framework.parsers import MultiPartParser
+from rest_framework.exceptions import ValidationError
 from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_200_OK
 from rest_framework.response import Response
 
 from cronus.settings import MEDIA_ROOT
 from services.utils import remove_file
+from services.storage import load_response
+from services.buffer import live_status
+from services.scheduler import schedule
+from services.tasks import select_sets
 from services.pagination import CustomPagination
 from services.models import Projects, Config, Counter, Cases, Tasks, Sets, CasesRelationShip, SetsRelationShip, \
-    CrontabSchedule, PeriodicTask
+    CrontabSchedule, PeriodicTask, LoadSummary, Histories, PeriodicTrigger
 from services.permissions import CRUDPermission, AssociateCasePermission, RemoveCasePermission, \
     AssociateConfigPermission, AssociateCounterPermission, AssociateSetPermission, RemoveSetsPermission, \
     RunnerPermission
@@ -19,7 +26,7 @@ from services.serializers import ProjectSerializer, ConfigSerializer, CounterSer
     SetsSerializer, TasksSerializer, CaseBindingSerializer, OrderSerializer, UnboundCaseSerializer, \
     ConfigBindingSerializer, CounterBindingSerializer, SetBindingSerializer, UnboundSetsSerializer, RunnerSerializer, \
     CaseRelationShipSerializer, SetRelationShipSerializer, ReportSerializer, CronScheduleSerializer, \
-    PeriodicTaskSerializer
+    PeriodicTaskSerializer, LoadSummarySerializer, HistorySerializer, ParameterSerializer, PeriodicTriggerSerializer
 
 
 logger = logging.getLogger()
@@ -187,6 +194,19 @@ class SetsViewSet(viewsets.ModelViewSet):
         instance.delete()
 
 
+class ParameterViewSet(mixins.UpdateModelMixin, viewsets.GenericViewSet):
+    """
+    replace the parameter rows of a test set with an uploaded csv file
+    """
+    serializer_class = ParameterSerializer
+    permission_classes = [CRUDPermission]
+    parser_classes = [MultiPartParser]
+    http_method_names = ['put']
+
+    def get_queryset(self):
+        return Sets.objects.all()
+
+
 class TasksViewSet(viewsets.ModelViewSet):
     serializer_class = TasksSerializer
     permission_classes = [CRUDPermission]
@@ -400,6 +420,11 @@ class RunnerViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
             return Sets.objects.all()
         elif level == 'tasks':
             return Tasks.objects.all()
+        elif level == 'load':
+            target = data.get('target')
+            if target == 'sets':
+                return Sets.objects.all()
+            return Cases.objects.all()
 
     def create(self, request, *args, **kwargs):
         data = request.data
@@ -415,6 +440,8 @@ class RunnerViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
             ret = SetsSerializer(Sets.objects.get(pk=obj_id)).data
         elif level == 'task':
             ret = TasksSerializer(Tasks.objects.get(pk=obj_id)).data
+        elif level == 'load':
+            ret = serializer.data
 
         return Response(ret, status=HTTP_201_CREATED)
 
@@ -440,7 +467,7 @@ class HistoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     def get_queryset(self):
         pass
 
-    def _filter_data(self, contents, batch=None):
+    def _filter_data(self, contents, batch=None, live=None):
         ret = []
         if contents:
             if not isinstance(contents, QuerySet):
@@ -454,6 +481,10 @@ class HistoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                         if record['batch'] == batch:
                             serializer['history'] = record
                             break
+                    else:
+                        # cases still running are not written to the database yet
+                        if live and serializer.get('id') in live:
+                            serializer['history'] = live[serializer.get('id')]
                 ret.append(serializer)
         return ret
 
@@ -469,7 +500,16 @@ class HistoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         if not task_id:
             task_id = None
 
+        if batch:
+            try:
+                batch = uuid.UUID(batch)
+            except ValueError:
+                raise ValidationError({'batch': 'batch is not a valid UUID'})
+            # live status is keyed by the hex form, serialized histories have the dashed form
+            batch_hex, batch = batch.hex, str(batch)
+
         query_set = None
+        live = None
 
         if types == 'cases':
             query_set = Cases.objects.filter(id=obj_id)
@@ -482,11 +522,13 @@ class HistoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
 
         elif types == 'set_cases' or types == 'task_cases':
             query_set = CasesRelationShip.objects.filter(sets_id=obj_id, handler=handler, tasks_id=task_id)
+            if batch:
+                live = live_status(batch_hex)
 
         elif types == 'task_sets':
             query_set = SetsRelationShip.objects.filter(tasks_id=obj_id)
 
-        ret = self._filter_data(query_set, batch)
+        ret = self._filter_data(query_set, batch, live)
 
         if not batch and ret:
             ret = ret[0].get('history')
@@ -494,6 +536,41 @@ class HistoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         return Response(ret)
 
 
+class ResponseViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    full response of a history, loaded from its file when it is too large to be stored inline
+    """
+    serializer_class = HistorySerializer
+
+    def get_queryset(self):
+        return Histories.objects.only('id', 'response')
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return Response(load_response(instance.response))
+
+
+class LoadViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    summaries of load runs
+    """
+    serializer_class = LoadSummarySerializer
+    pagination_class = CustomPagination
+
+    def get_queryset(self):
+        queryset = LoadSummary.objects.all()
+        case_id = self.request.query_params.get('cases', None)
+        set_id = self.request.query_params.get('sets', None)
+        batch = self.request.query_params.get('batch', None)
+        if case_id:
+            queryset = queryset.filter(cases_id=case_id)
+        if set_id:
+            queryset = queryset.filter(sets_id=set_id)
+        if batch:
+            queryset = queryset.filter(batch=batch)
+        return queryset
+
+
 class ReportViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     serializer_class = ReportSerializer
 
@@ -554,6 +631,28 @@ class ReportViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         return Response(ret, status=HTTP_200_OK)
 
 
+class ScheduleViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    dispatch order of the sets of a task and its predicted makespan
+    """
+
+    def get_queryset(self):
+        return Tasks.objects.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        tags = self.request.query_params.get('tags', None)
+        workers = self.request.query_params.get('workers', None)
+        kwargs = {'workers': int(workers)} if workers and workers.isdigit() else {}
+        plan, makespan = schedule(select_sets(instance.id, tags), **kwargs)
+        ret = {
+            'makespan': makespan,
+            'sets': [{'id': str(test_set.id), 'name': test_set.name, 'duration': duration, 'worker': worker}
+                     for test_set, duration, worker in plan]
+        }
+        return Response(ret, status=HTTP_200_OK)
+
+
 class CronScheduleViewSet(viewsets.ModelViewSet):
     serializer_class = CronScheduleSerializer
     pagination_class = CustomPagination
@@ -616,9 +715,31 @@ class PeriodicTaskViewSet(viewsets.ModelViewSet):
         data['project'] = Projects.objects.get(name=data['project']).id
         data['task'] = 'services.tasks.periodic_task'
         data['args'] = json.dumps([data.get('tasks')])
-        data['kwargs'] = json.dumps({'tags': data.get('tags'), 'category': data.get('category')})
         instance = self.get_object()
+        data['kwargs'] = json.dumps({'tags': data.get('tags'), 'category': data.get('category'),
+                                     'periodic': instance.id})
         serializer = self.get_serializer(instance, data=data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
         return Response(serializer.data)
+
+
+class PeriodicTriggerViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    ticks of periodic tasks and whether they started, skipped, queued or coalesced a run
+    """
+    serializer_class = PeriodicTriggerSerializer
+    pagination_class = CustomPagination
+
+    def get_queryset(self):
+        queryset = PeriodicTrigger.objects.all()
+        periodic = self.request.query_params.get('periodic', None)
+        task_id = self.request.query_params.get('tasks', None)
+        decision = self.request.query_params.get('decision', None)
+        if periodic:
+            queryset = queryset.filter(periodic_id=periodic)
+        if task_id:
+            queryset = queryset.filter(tasks_id=task_id)
+        if decision:
+            queryset = queryset.filter(decision=decision)
+        return queryset